@@ -1,7 +1,10 @@
-from fastapi import FastAPI
+import json
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel
-from main import main
+from main import amain, astream_main, startup
+from src.startup import ComponentUnavailable
 
 app = FastAPI(title="Annual Report RAG API")
 
@@ -13,19 +16,55 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(ComponentUnavailable)
+async def component_unavailable(request: Request, exc: ComponentUnavailable):
+    return JSONResponse(status_code=503, content={"status": "unavailable", "detail": str(exc)})
+
+
 class QueryRequest(BaseModel):
     query: str
 
 
 @app.post("/query")
-def ask_question(req: QueryRequest):
-    response, metadata = main(req.query)  # Get both response and metadata
+async def ask_question(req: QueryRequest):
+    response, metadata = await amain(req.query)  # Get both response and metadata
     return {
         "response": response,
         "metadata": metadata
     }
 
 
+@app.post("/query/stream")
+async def ask_question_stream(req: QueryRequest):
+    """
+    Server-sent events: one `metadata` event, then `token` events, then `done`.
+    A `discard` event means the answer tripped the outbound check part-way: drop
+    the tokens shown so far and display the `done` response instead.
+    """
+    await startup.await_ready()  # fail with 503 before the stream starts, not inside it
+
+    async def event_stream():
+        async for event, data in astream_main(req.query):
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/")
 def health_check():
+    """Liveness: the process is up (components may still be starting); 503 once a critical component has failed for good, so it gets restarted."""
+    failed = startup.failed()
+    if failed:
+        return JSONResponse(status_code=503, content={"status": "failed", "message": "Critical components failed to start", "failed": failed})
     return {"status": "ok", "message": "RAG server running"}
+
+
+@app.get("/ready")
+def readiness_check():
+    """Readiness: 200 once every critical component is up, else 503; includes per-component init timings."""
+    report = startup.report()
+    return JSONResponse(status_code=200 if report["ready"] else 503, content=report)
@@ -0,0 +1 @@
+"""Latency / throughput benchmarks for the RAG pipeline stages"""
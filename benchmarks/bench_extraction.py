@@ -0,0 +1,54 @@
+"""
+PDF extraction throughput: pages/sec against worker count.
+
+Runs the local extractor (PyMuPDF, process pool over page ranges) over a folder
+of PDFs and, optionally, the Lambda extractor (pypdf, Process + Pipe fan-out)
+over one file, for each worker count.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_extraction --folder ../knowledge_base --workers 1 2 4 8
+    python -m benchmarks.bench_extraction --lambda-pdf ../knowledge_base/Apple-2024-Annual-Report.pdf
+"""
+import argparse
+import os
+import sys
+import time
+
+from src.ingestion_local import load_all_pdfs
+
+
+def bench_local(folder, workers):
+    t0 = time.perf_counter()
+    docs = load_all_pdfs(folder, workers=workers)
+    return len(docs), time.perf_counter() - t0
+
+
+def bench_lambda(pdf_path, workers):
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "aws_infra", "lambda_ingestion"))
+    from ingestion import extract_pages_from_pdf
+
+    t0 = time.perf_counter()
+    pages = extract_pages_from_pdf(pdf_path, workers=workers)
+    return len(pages), time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--folder", default="../knowledge_base")
+    parser.add_argument("--lambda-pdf", default=None)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    print(f"{'extractor':<10} {'workers':>7} {'pages':>7} {'seconds':>8} {'pages/s':>9}")
+    for workers in args.workers:
+        pages, seconds = bench_local(args.folder, workers)
+        print(f"{'local':<10} {workers:>7} {pages:>7} {seconds:>8.2f} {pages / seconds:>9.1f}")
+
+    if args.lambda_pdf:
+        for workers in args.workers:
+            pages, seconds = bench_lambda(args.lambda_pdf, workers)
+            print(f"{'lambda':<10} {workers:>7} {pages:>7} {seconds:>8.2f} {pages / seconds:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
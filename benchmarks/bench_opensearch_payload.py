@@ -0,0 +1,82 @@
+"""
+OpenSearch response payload: full _source vs the projected / filter_path'd search.
+
+For every "rag" query from the router examples, runs the kNN and BM25 searches
+twice, once the old way (entire _source, including the 3072-float embedding,
+plus the full response envelope) and once as src/retrieval.py sends them now,
+and reports per query:
+  - response bytes on the wire
+  - JSON decode + hit -> Document time
+
+Raw bodies are read straight off the connection so the numbers exclude the
+client's own deserialisation.
+
+Usage (from the repo root, needs MY_OPENAI_API_KEY and OpenSearch access):
+    python -m benchmarks.bench_opensearch_payload
+    python -m benchmarks.bench_opensearch_payload --k 20 --rounds 5
+"""
+import argparse
+import json
+import statistics
+import time
+from urllib.parse import urlencode
+
+from src.local_router import load_examples
+from src.retrieval import get_embedding_model, knn_query_body, bm25_query_body, docs_from_response, SEARCH_FILTER_PATH
+from src.aws_infra.opensearch.client import get_opensearch_client
+
+
+def raw_search(client, index_name, body, filter_path=None):
+    url = f"/{index_name}/_search"
+    if filter_path:
+        url += "?" + urlencode({"filter_path": filter_path})
+    connection = client.transport.get_connection()
+    _, _, raw = connection.perform_request("POST", url, body=json.dumps(body).encode("utf-8"))
+    return raw
+
+
+def full_body(body):
+    body = dict(body)
+    body.pop("_source", None)
+    return body
+
+
+def measure(raw_bodies, rounds):
+    sizes = [len(raw.encode("utf-8")) if isinstance(raw, str) else len(raw) for raw in raw_bodies]
+    parse_ms = []
+    for _ in range(rounds):
+        for raw in raw_bodies:
+            t0 = time.perf_counter()
+            docs_from_response(json.loads(raw))
+            parse_ms.append((time.perf_counter() - t0) * 1000)
+    return statistics.mean(sizes), statistics.median(parse_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index-name", default="rag-docs")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    queries = [e["query"] for e in load_examples() if e["label"] == "rag"]
+    vectors = get_embedding_model().embed_documents(queries)
+    client = get_opensearch_client()
+
+    bodies = [knn_query_body(v, args.k) for v in vectors] + [bm25_query_body(q, args.k) for q in queries]
+
+    full = [raw_search(client, args.index_name, full_body(b)) for b in bodies]
+    lean = [raw_search(client, args.index_name, b, SEARCH_FILTER_PATH) for b in bodies]
+
+    full_bytes, full_ms = measure(full, args.rounds)
+    lean_bytes, lean_ms = measure(lean, args.rounds)
+
+    print(f"{len(bodies)} searches (kNN + BM25), k={args.k}\n")
+    print(f"{'payload':<10} {'bytes/query':>12} {'parse ms p50':>13}")
+    print(f"{'full':<10} {full_bytes:>12.0f} {full_ms:>13.3f}")
+    print(f"{'lean':<10} {lean_bytes:>12.0f} {lean_ms:>13.3f}")
+    print(f"\nbytes: {full_bytes / lean_bytes:.1f}x smaller, parse: {full_ms / lean_ms:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
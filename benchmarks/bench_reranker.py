@@ -0,0 +1,87 @@
+"""
+Reranker throughput benchmark: per-request CrossEncoder.predict vs the
+micro-batching RerankerService, for each CPU backend.
+
+Simulates `--clients` concurrent requests, each scoring `--candidates`
+(query, chunk) pairs, and reports pairs/sec plus p50 / p99 request latency.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_reranker --clients 16 --requests 200
+    python -m benchmarks.bench_reranker --backends torch int8 onnx --threads 4
+"""
+import argparse
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.rerankers import load_reranker, RerankerService
+
+WORDS = (
+    "revenue operating income fiscal year cloud segment growth margin "
+    "cash flow dividends share repurchase guidance advertising devices "
+    "services data center gaming research development capital expenditure"
+).split()
+
+
+def make_requests(n_requests, n_candidates, seed=0):
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(n_requests):
+        query = " ".join(rng.choices(WORDS, k=8))
+        pairs = [(query, " ".join(rng.choices(WORDS, k=180))) for _ in range(n_candidates)]
+        requests.append(pairs)
+    return requests
+
+
+def run(scorer, requests, clients):
+    latencies = []
+
+    def one(pairs):
+        t0 = time.perf_counter()
+        scorer.predict(pairs)
+        latencies.append(time.perf_counter() - t0)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(one, requests))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    n_pairs = sum(len(p) for p in requests)
+    return {
+        "pairs_per_sec": n_pairs / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["torch", "int8"])
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--candidates", type=int, default=12)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    requests = make_requests(args.requests, args.candidates)
+
+    print(f"{'backend':<10} {'mode':<12} {'pairs/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for backend in args.backends:
+        model = load_reranker(backend=backend, threads=args.threads)
+        model.predict(requests[0])  # warm-up
+
+        modes = [
+            ("per-request", model),
+            ("batched", RerankerService(model, args.max_batch, args.max_wait_ms)),
+        ]
+        for mode, scorer in modes:
+            r = run(scorer, requests, args.clients)
+            print(f"{backend:<10} {mode:<12} {r['pairs_per_sec']:>9.1f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Retriever latency: OpenSearch kNN vs the local FAISS index.
+
+Every "rag" query from the router examples is embedded once up front, then the
+same vectors are searched on each backend, so the numbers are pure search +
+chunk hydration time (no embedding API call in the loop). Reports p50 / p99 /
+mean per backend and the overlap of their top-k results.
+
+Usage (from the repo root, after `python -m src.ingestion_local`):
+    python -m benchmarks.bench_retrievers
+    python -m benchmarks.bench_retrievers --backends faiss --rounds 20
+"""
+import argparse
+import statistics
+import time
+
+from src.local_router import load_examples
+from src.retrieval import get_embedding_model, knn_retrieve_os, chunk_key, FaissRetriever
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["faiss", "opensearch"])
+    parser.add_argument("--index-dir", default="faiss_index")
+    parser.add_argument("--index-name", default="rag-docs")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    queries = [e["query"] for e in load_examples() if e["label"] == "rag"]
+    vectors = get_embedding_model().embed_documents(queries)
+    print(f"{len(queries)} queries embedded, {args.rounds} rounds, k={args.k}\n")
+
+    searchers = {}
+    if "faiss" in args.backends:
+        faiss_retriever = FaissRetriever(args.index_dir, embedder=None)
+        searchers["faiss"] = lambda v: faiss_retriever.knn(v, k=args.k)
+    if "opensearch" in args.backends:
+        from src.aws_infra.opensearch.client import get_opensearch_client
+        client = get_opensearch_client()
+        searchers["opensearch"] = lambda v: knn_retrieve_os(v, client, args.index_name, k=args.k)
+
+    results = {}
+    print(f"{'backend':<12} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+    for name, search in searchers.items():
+        search(vectors[0])  # warm-up: connections, page cache
+        latencies = []
+        for _ in range(args.rounds):
+            for v in vectors:
+                t0 = time.perf_counter()
+                search(v)
+                latencies.append((time.perf_counter() - t0) * 1000)
+        results[name] = [[chunk_key(d) for d in search(v)] for v in vectors]
+        print(f"{name:<12} {statistics.median(latencies):>9.3f} {percentile(latencies, 0.99):>9.3f} {statistics.mean(latencies):>9.3f}")
+
+    if len(results) == 2:
+        a, b = results.values()
+        overlap = statistics.mean(len(set(x) & set(y)) / max(len(x), 1) for x, y in zip(a, b))
+        print(f"\ntop-{args.k} overlap between backends: {overlap:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Local router vs LLM router: agreement and latency report.
+
+Runs labelled queries through the on-box router and the gpt-4.1-mini router
+(ROUTER_PROMPT). By default these are src/router_model/eval_queries.jsonl,
+written independently of the training templates; --examples takes a labelled
+query log instead. Prints which set was used, then:
+  - accuracy of each against the labels
+  - agreement between the hybrid decision and the LLM decision
+  - share of queries the local router settles on its own
+  - p50 / p99 routing latency of each path
+
+Usage (from the repo root, needs MY_OPENAI_API_KEY):
+    python -m benchmarks.bench_router
+    python -m benchmarks.bench_router --examples path/to/query_log.jsonl
+"""
+import argparse
+import statistics
+import time
+
+from src.local_router import evaluation_set, load_local_router
+from src.router import load_router_llm, route_query, local_route
+from src.prompts import ROUTER_PROMPT
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--examples", default=None, help="labelled query log (JSONL); default: out-of-template queries")
+    args = parser.parse_args()
+
+    examples, source = evaluation_set(args.examples)
+    local_router = load_local_router()
+    router_llm = load_router_llm()
+
+    local_ms, llm_ms = [], []
+    local_correct = llm_correct = hybrid_agree = settled_locally = 0
+
+    for e in examples:
+        t0 = time.perf_counter()
+        local_decision, _ = local_route(e["query"], local_router)
+        local_ms.append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        llm_decision = route_query(e["query"], router_llm, ROUTER_PROMPT)
+        llm_ms.append((time.perf_counter() - t0) * 1000)
+
+        hybrid_decision = local_decision if local_decision is not None else llm_decision
+        settled_locally += local_decision is not None
+        local_correct += local_router.predict(e["query"])[0] == e["label"]
+        llm_correct += llm_decision == e["label"]
+        hybrid_agree += hybrid_decision == llm_decision
+
+    n = len(examples)
+    print(f"evaluated on:            {source}")
+    print(f"examples:                {n}")
+    print(f"local accuracy:          {local_correct / n:.3f}")
+    print(f"llm accuracy:            {llm_correct / n:.3f}")
+    print(f"hybrid/llm agreement:    {hybrid_agree / n:.3f}")
+    print(f"settled locally:         {settled_locally / n:.3f} (threshold {local_router.threshold:.3f})")
+    print(f"local latency p50 / p99: {statistics.median(local_ms):.3f} / {percentile(local_ms, 0.99):.3f} ms")
+    print(f"llm latency   p50 / p99: {statistics.median(llm_ms):.1f} / {percentile(llm_ms, 0.99):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
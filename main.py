@@ -1,30 +1,557 @@
-from src.retrieval import get_embedding_model, retrieve_candidates_os
-from src.rerankers import load_reranker, rerank_documents
-from src.router import load_router_llm, route_query
-from src.generation import generate_answer_rag, load_generator_llm, build_context, generate_answer_chat
-from src.caching import load_redis_client, cache_get, cache_set
-from src.memory import initialize_redis, build_memory_chain, generate_answer_chat_memory, memory_set 
-from src.guardrails import inbound_check, outbound_check
+from src.retrieval import get_embedding_model, load_retriever
+from src.rerankers import load_reranker, rerank_documents, arerank_documents, RerankerService, reranker_id
+from src.router import load_router_llm, load_local_router, route_query, aroute_query, local_route
+from src.generation import generate_answer_rag, agenerate_answer_rag, astream_answer_rag, load_generator_llm, build_context, generate_answer_chat
+from src.caching import load_redis_client, load_async_redis_client, get_binary_client, cache_get, cache_set, acache_get, acache_set, EmbeddingCache, CachedEmbeddings, SemanticCache, semantic_guard, RerankScoreCache, SingleFlight, CorpusVersions, ResultCache, NearCache
+from src.memory import initialize_redis, build_memory_chain, generate_answer_chat_memory, agenerate_answer_chat_memory, astream_answer_chat_memory, memory_set, amemory_set
+from src.guardrails import inbound_check, outbound_check, OutboundStream
 from src.prompts import ROUTER_PROMPT, GENERATION_PROMPT, get_chat_prompt
-from src.aws_infra.opensearch.client import get_opensearch_client
+from src.query_filters import QueryFilterExtractor
+from src.startup import StartupManager
+from src.aws_infra.opensearch.client import get_opensearch_client, get_async_opensearch_client
 import os 
+import time
+import asyncio
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
-redis_client = load_redis_client()
+# Every client / model below is built by `startup` on its own thread as soon as its
+# dependencies are ready and then published as a module global under its name.
+# Importing this module therefore returns immediately; the pipelines wait for the
+# critical components, and /ready (backend_server/app.py) reports progress.
+startup = StartupManager(
+    namespace=globals(),
+    retries=int(os.getenv("STARTUP_RETRIES", "3")),
+    backoff_s=float(os.getenv("STARTUP_RETRY_BACKOFF_S", "1")),
+)
 
-initialize_redis(redis_client)  # for src/memory.py
+redis_client = async_redis_client = None
+router_llm = local_router = generator_llm = None
+embedding_cache = embedding_model = None
+opensearch_client = async_opensearch_client = None
+retriever = filter_extractor = None
+# global corpus versions the faiss retriever's files were opened at (None for opensearch,
+# which always serves the live index) and the filter extractor's known values were read at;
+# both are refreshed through _serving_version() after a re-ingest
+retriever_version = filters_version = None
+reranker = rerank_score_cache = None
+memory_chain = single_flight = corpus_versions = None
+retrieval_cache = context_cache = None
+answer_near_cache = history_near_cache = None
 
-router_llm = load_router_llm()
-generator_llm = load_generator_llm()
+# fold turns that fall out of the MEMORY_WINDOW into a rolling summary (one small LLM call per overflow)
+memory_summary = os.getenv("MEMORY_SUMMARY", "false").lower() == "true"
 
-embedding_model = get_embedding_model()
-opensearch_client = get_opensearch_client()
+# "hybrid" routes on-box and only asks the LLM when the local model is unsure; "llm" always asks the LLM
+router_mode = os.getenv("ROUTER_MODE", "hybrid")
+local_router_threshold = float(os.getenv("LOCAL_ROUTER_THRESHOLD", "0")) or None  # 0 = calibrated value
 
-reranker = load_reranker()
+# "opensearch" queries the cluster; "faiss" searches the index built by src/ingestion_local.py in-process
+retriever_backend = os.getenv("RETRIEVER_BACKEND", "opensearch")
 
 session_id = 1
 opensearch_index_name="rag-docs"
 
+# "parallel" overlaps the BM25 and kNN legs, "sequential" runs them one after the other
+retrieval_mode = os.getenv("RETRIEVAL_MODE", "parallel")
+
+# only the top-N fused candidates are sent to the cross-encoder
+rerank_candidates = int(os.getenv("RERANK_CANDIDATES", "12"))
+
+# "background": serve traffic while the cross-encoder loads (fused order until then);
+# "eager": the reranker gates readiness like the other critical components
+reranker_load = os.getenv("RERANKER_LOAD", "background")
+
+# answers are cached under the corpus version, so they can live long: re-ingestion invalidates them
+answer_cache_ttl = int(os.getenv("ANSWER_CACHE_TTL", str(7 * 86400)))
+# "global": any re-ingest invalidates every answer; "company": queries naming a company
+# are only invalidated when that company's documents change
+cache_version_scope = os.getenv("CACHE_VERSION_SCOPE", "global")
+
+# in-process copies of hot answer / session-history keys in front of Redis (write-through)
+near_cache_enabled = os.getenv("NEAR_CACHE", "false").lower() == "true"
+
+# (query, chunk) scores are reused across answer-cache misses; Redis tier is optional
+rerank_cache_redis = os.getenv("RERANK_CACHE_REDIS", "true").lower() == "true"
+
+
+def _load_embedding_cache():
+    return EmbeddingCache(
+        get_binary_client(redis_client),
+        max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "2048")),
+        async_redis_client=load_async_redis_client(decode_responses=False),
+    )
+
+
+def _load_reranker():
+    model = load_reranker()  # RERANKER_BACKEND / RERANKER_THREADS
+    if os.getenv("RERANKER_BATCHING", "true").lower() == "true":
+        # concurrent requests share cross-encoder batches instead of fighting over the CPU
+        return RerankerService(
+            model,
+            max_batch_size=int(os.getenv("RERANKER_MAX_BATCH", "64")),
+            max_wait_ms=float(os.getenv("RERANKER_MAX_WAIT_MS", "5")),
+        )
+    return model
+
+
+def _load_rerank_score_cache():
+    return RerankScoreCache(
+        reranker_id(),  # int8 / ONNX scores differ from torch ones: keep them apart in Redis
+        redis_client if rerank_cache_redis else None,
+        max_entries=int(os.getenv("RERANK_CACHE_SIZE", "50000")),
+        async_redis_client=async_redis_client if rerank_cache_redis else None,
+    )
+
+
+def _load_single_flight():
+    if os.getenv("SINGLE_FLIGHT", "true").lower() != "true":
+        return None
+    return SingleFlight(
+        redis_client,
+        async_redis_client,
+        lock_ttl_ms=int(os.getenv("SINGLE_FLIGHT_LOCK_MS", "60000")),
+        wait_timeout=float(os.getenv("SINGLE_FLIGHT_WAIT_S", "30")),
+    )
+
+
+def _load_near_cache(name: str, listen: bool = False):
+    if not near_cache_enabled:
+        return None
+    cache = NearCache(
+        name,
+        max_entries=int(os.getenv("NEAR_CACHE_SIZE", "10000")),
+        max_ttl=float(os.getenv("NEAR_CACHE_TTL", "30")),
+    )
+    if listen and os.getenv("NEAR_CACHE_INVALIDATION", "pubsub") == "pubsub":
+        # other workers publish the history keys they write; drop our copies of those
+        cache.listen(redis_client)
+    return cache
+
+
+def _load_result_cache(layer: str, namespace: str, default_ttl: int):
+    # RETRIEVAL_CACHE* / CONTEXT_CACHE*: each layer has its own switch, TTL and in-process memory cap
+    if os.getenv(f"{layer}_CACHE", "true").lower() != "true":
+        return None
+    return ResultCache(
+        namespace,
+        get_binary_client(redis_client),
+        load_async_redis_client(decode_responses=False),
+        ttl=int(os.getenv(f"{layer}_CACHE_TTL", str(default_ttl))),
+        max_bytes=int(float(os.getenv(f"{layer}_CACHE_MAX_MB", "16")) * 1024 * 1024),
+    )
+
+
+def _open_retriever():
+    """(retriever, global corpus version its files were opened at)."""
+    # read before the files are opened: ingestion bumps the version only after writing them
+    version = corpus_versions.version() if retriever_backend == "faiss" else None
+    return load_retriever(
+        retriever_backend,
+        embedding_model,
+        opensearch_client,
+        async_opensearch_client,
+        index_name=opensearch_index_name,
+        index_dir=os.getenv("FAISS_INDEX_DIR", "faiss_index"),
+        parallel=retrieval_mode == "parallel",
+    ), version
+
+
+def _load_retriever():
+    global retriever_version
+    loaded, retriever_version = _open_retriever()
+    return loaded
+
+
+_reload_lock = threading.Lock()
+_reload_after = 0.0  # monotonic time before which a failed reload is not retried
+
+
+def _refresh_corpus(latest: int):
+    """
+    Catch up with a re-ingest (own thread, holds _reload_lock): re-open the FAISS
+    index, chunk store and BM25 arrays, then re-read the filter extractor's known
+    companies / years, so a newly ingested company is filtered on too.
+    """
+    global retriever, retriever_version, filter_extractor, filters_version, _reload_after
+    try:
+        if retriever_version is not None and latest > retriever_version:
+            loaded, version = _open_retriever()
+            # swap the retriever before the version, so no request caches old results under the new one
+            retriever = loaded
+            retriever_version = version
+            print(f"🔄 Retriever reloaded at corpus version {version}")
+        if filters_version is not None and latest > filters_version:
+            filter_extractor, filters_version = _open_filter_extractor()
+    except Exception as e:
+        _reload_after = time.monotonic() + 30
+        print(f"⚠️ Corpus refresh failed, retrying in 30s: {e}")
+    finally:
+        _reload_lock.release()
+
+
+def _serving_version(tag: str) -> str:
+    """
+    Cache namespace for this request; also the hook that starts _refresh_corpus()
+    once a newer corpus version shows up. The faiss backend serves the files it
+    opened at load time, so until the reload succeeds it keeps caching under the
+    version it loaded rather than the new one.
+    """
+    latest = corpus_versions.last_version()
+    if latest is None:
+        return tag
+    stale = any(v is not None and latest > v for v in (retriever_version, filters_version))
+    if stale and time.monotonic() >= _reload_after and _reload_lock.acquire(blocking=False):
+        threading.Thread(target=_refresh_corpus, args=(latest,), name="corpus-refresh", daemon=True).start()
+    if retriever_version is not None and latest > retriever_version:
+        return f"v{retriever_version}"
+    return tag
+
+
+def _open_filter_extractor():
+    """(extractor, global corpus version its known values were read at)."""
+    version = corpus_versions.version()
+    known_values = retriever.known_values()
+    print("Query filters ready:", {f: len(v) for f, v in known_values.items()}, f"(corpus version {version})")
+    return QueryFilterExtractor(known_values), version
+
+
+def _load_filter_extractor():
+    global filters_version
+    # company / year mentioned in the query become filters on both retrieval legs
+    if os.getenv("QUERY_FILTERS", "true").lower() != "true":
+        return None
+    extractor, filters_version = _open_filter_extractor()
+    return extractor
+
+
+startup.register("redis_client", load_redis_client)
+startup.register("async_redis_client", load_async_redis_client)
+startup.register("router_llm", load_router_llm)
+# answer keys are versioned and written once, so only history copies need cross-process invalidation
+startup.register("answer_near_cache", lambda: _load_near_cache("answers"))
+startup.register("history_near_cache", lambda: _load_near_cache("history", listen=True), deps=("redis_client",))
+# for src/memory.py; the (cheaper) router model writes rolling summaries when MEMORY_SUMMARY=true
+startup.register("session_memory", lambda: initialize_redis(redis_client, async_redis_client, summary_llm=router_llm if memory_summary else None, near_cache=history_near_cache), deps=("redis_client", "async_redis_client", "router_llm", "history_near_cache"))
+startup.register("local_router", lambda: load_local_router() if router_mode == "hybrid" else None)
+startup.register("generator_llm", load_generator_llm)
+# built once; it reads the windowed history and saves the turn itself
+startup.register("memory_chain", lambda: build_memory_chain(generator_llm, get_chat_prompt()), deps=("generator_llm", "session_memory"))
+startup.register("embedding_cache", _load_embedding_cache, deps=("redis_client",))
+startup.register("embedding_model", lambda: CachedEmbeddings(get_embedding_model(), embedding_cache), deps=("embedding_cache",))
+
+retriever_deps = ("embedding_model",)
+if retriever_backend == "faiss":
+    retriever_deps += ("corpus_versions",)
+if retriever_backend == "opensearch":
+    startup.register("opensearch_client", get_opensearch_client)
+    startup.register("async_opensearch_client", get_async_opensearch_client)
+    retriever_deps += ("opensearch_client", "async_opensearch_client")
+startup.register("retriever", _load_retriever, deps=retriever_deps)
+
+# failures here only turn query filters off
+startup.register("filter_extractor", _load_filter_extractor, deps=("retriever", "corpus_versions"), critical=False)
+startup.register("single_flight", _load_single_flight, deps=("redis_client", "async_redis_client"))
+# beneath the answer cache: fused candidates (skip retrieval) and reranked context (skip retrieval + reranker);
+# namespaces include what shaped the stored list, so a config change does not reuse old entries
+startup.register("retrieval_cache", lambda: _load_result_cache("RETRIEVAL", f"retr:{retriever_backend}:{rerank_candidates}", 30 * 86400), deps=("redis_client",))
+startup.register("context_cache", lambda: _load_result_cache("CONTEXT", f"ctx:{retriever_backend}:{rerank_candidates}:{reranker_id()}:10", 14 * 86400), deps=("redis_client",))
+startup.register("corpus_versions", lambda: CorpusVersions(redis_client, async_redis_client, ttl=float(os.getenv("CORPUS_VERSION_REFRESH_S", "5"))), deps=("redis_client", "async_redis_client"))
+startup.register("rerank_score_cache", _load_rerank_score_cache, deps=("redis_client", "async_redis_client"))
+startup.register("reranker", _load_reranker, critical=reranker_load == "eager")
+startup.start()
+
+# start cache lookup + retrieval while the router LLM is still deciding;
+# the speculative work is dropped if the router says "direct"
+speculative_retrieval = os.getenv("SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+_speculation_executor = ThreadPoolExecutor(max_workers=int(os.getenv("SPECULATION_WORKERS", "8")), thread_name_prefix="speculate")
+speculation_stats = {"runs": 0, "wasted": 0}
+
+# nearest-neighbour answer cache, consulted after an exact-match miss
+semantic_cache = None
+if os.getenv("SEMANTIC_CACHE", "true").lower() == "true":
+    semantic_cache = SemanticCache(
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+        capacity=int(os.getenv("SEMANTIC_CACHE_SIZE", "1000")),
+        ttl=int(os.getenv("SEMANTIC_CACHE_TTL", "3600")),
+    )
+
+
+def _filters_settled():
+    """False while the filter extractor is still loading: filters extracted now would be empty even for scoped queries."""
+    return startup.is_ready("filter_extractor") or startup.status("filter_extractor") == "failed"
+
+
+def _semantic_lookup(query: str, query_vector, metadata: dict):
+    """Check the semantic cache and record the outcome in metadata."""
+    if not _filters_settled():
+        metadata["semantic_cache"] = {"status": "skipped", "filter_extractor": startup.status("filter_extractor")}
+        return None
+    guard = semantic_guard(query, metadata["filters"])
+    answer, similarity, matched_query = semantic_cache.lookup(query_vector, version=metadata["corpus_version"], guard=guard)
+    metadata["semantic_cache"] = {
+        "status": "hit" if answer else "miss",
+        "similarity": round(similarity, 4),
+        "matched_query": matched_query,
+        "hit_rate": round(semantic_cache.hit_rate(), 3),
+    }
+    return answer
+
+
+def _semantic_add(query: str, query_vector, answer: str, metadata: dict):
+    if _filters_settled():
+        semantic_cache.add(query, query_vector, answer, version=metadata["corpus_version"], guard=semantic_guard(query, metadata["filters"]))
+
+
+def _local_route(query: str, metadata: dict):
+    """Try the on-box router; returns the decision, or None if the LLM must decide."""
+    if local_router is None:
+        metadata["router_source"] = "llm"
+        return None
+
+    decision, confidence = local_route(query, local_router, local_router_threshold)
+    metadata["router_source"] = "local" if decision is not None else "llm"
+    metadata["router_confidence"] = round(confidence, 3)
+    return decision
+
+
+def _record_speculation(metadata: dict, wasted: bool):
+    speculation_stats["runs"] += 1
+    speculation_stats["wasted"] += int(wasted)
+    metadata["speculative"] = {
+        "wasted": wasted,
+        "wasted_rate": round(speculation_stats["wasted"] / speculation_stats["runs"], 3),
+    }
+
+
+def _reranker_ready(metadata: dict):
+    """False while the cross-encoder is still loading in the background (or failed to); the fused order is used meanwhile."""
+    if startup.is_ready("reranker"):
+        return True
+    metadata["reranker"] = startup.status("reranker")
+    return False
+
+
+def _extract_filters(query: str, metadata: dict):
+    filters = filter_extractor.extract(query) if filter_extractor is not None else {}
+    metadata["filters"] = filters
+    return filters
+
+
+def _version_scope(filters: dict):
+    return filters.get("company", ()) if cache_version_scope == "company" else ()
+
+
+def _hits(docs, score_field: str):
+    return [(d.metadata["chunk_id"], d.metadata[score_field]) for d in docs]
+
+
+def _rehydrate(entry: dict, docs, score_field: str):
+    """Fetched chunks in the cached order with the cached scores; None if any chunk is gone."""
+    by_id = {d.metadata["chunk_id"]: d for d in docs}
+    if any(cid not in by_id for cid, _ in entry["hits"]):
+        return None
+    for cid, score in entry["hits"]:
+        by_id[cid].metadata[score_field] = score
+    return [by_id[cid] for cid, _ in entry["hits"]]
+
+
+def _result_layers():
+    # most work saved first: reranked context skips retrieval and the reranker, candidates skip retrieval
+    layers = (("context_hit", context_cache, "rerank_score"), ("retrieval_hit", retrieval_cache, "rrf_score"))
+    return [layer for layer in layers if layer[1] is not None]
+
+
+def _record_result_hit(layer: str, docs, entry: dict, fetch_start: float, metadata: dict):
+    metadata["cache"] = layer
+    metadata["retriever"] = retriever.name
+    metadata["retrieved_chunks"] = len(docs)
+    metadata["retrieval_timings"] = {"fetch_ms": round((time.perf_counter() - fetch_start) * 1000, 1)}
+    if entry.get("filters_relaxed"):
+        metadata["filters_relaxed"] = True
+
+
+def _result_cache_stats(metadata: dict):
+    metadata["result_cache"] = {
+        cache.namespace.split(":")[0]: dict(cache.stats, hit_rate=round(cache.hit_rate(), 3))
+        for _, cache, _ in _result_layers()
+    }
+
+
+def _near_cache_stats(metadata: dict):
+    caches = [c for c in (answer_near_cache, history_near_cache) if c is not None]
+    if caches:
+        metadata["near_cache"] = {c.name: dict(c.stats, hit_rate=round(c.hit_rate(), 3)) for c in caches}
+
+
+def _cached_candidates(query: str, version: str, metadata: dict):
+    """Context cache, then retrieval cache. Rehydrated docs, or None if neither layer has the query."""
+    for layer, cache, score_field in _result_layers():
+        entry = cache.get(query, version, metadata["filters"])
+        if entry is None:
+            continue
+        t0 = time.perf_counter()
+        docs = _rehydrate(entry, retriever.fetch([cid for cid, _ in entry["hits"]]), score_field)
+        if docs is not None:
+            _record_result_hit(layer, docs, entry, t0, metadata)
+            _result_cache_stats(metadata)
+            return docs
+    _result_cache_stats(metadata)
+    return None
+
+
+async def _acached_candidates(query: str, version: str, metadata: dict):
+    """Async counterpart of _cached_candidates()."""
+    for layer, cache, score_field in _result_layers():
+        entry = await cache.aget(query, version, metadata["filters"])
+        if entry is None:
+            continue
+        t0 = time.perf_counter()
+        docs = _rehydrate(entry, await retriever.afetch([cid for cid, _ in entry["hits"]]), score_field)
+        if docs is not None:
+            _record_result_hit(layer, docs, entry, t0, metadata)
+            _result_cache_stats(metadata)
+            return docs
+    _result_cache_stats(metadata)
+    return None
+
+
+def _prefetch(query: str):
+    """
+    Everything on the RAG path that does not depend on the router decision:
+    answer cache, semantic cache and hybrid retrieval.
+    Returns (cached_answer, retrieved_docs, query_vector, metadata); on a cache
+    hit retrieved_docs is None.
+    """
+    metadata = {}
+    query_vector = None
+    filters = _extract_filters(query, metadata)
+
+    # -------------------- Redis Caching --------------------
+    # answers live under the current corpus version (see CACHE_VERSION_SCOPE)
+    version = metadata["corpus_version"] = _serving_version(corpus_versions.tag(_version_scope(filters)))
+    cached = cache_get(query, redis_client, version=version, near=answer_near_cache)
+    _near_cache_stats(metadata)
+    if cached:
+        return cached, None, None, metadata
+
+    # -------------------- Semantic Caching --------------------
+    if semantic_cache is not None:
+        # warms the embedding cache, so the kNN leg below does not embed again
+        query_vector = embedding_model.embed_query(query)
+        cached = _semantic_lookup(query, query_vector, metadata)
+        if cached:
+            return cached, None, query_vector, metadata
+
+    # -------------------- Context / Retrieval Caches --------------------
+    retrieved_docs = _cached_candidates(query, version, metadata)
+    if retrieved_docs is not None:
+        return None, retrieved_docs, query_vector, metadata
+
+    # -------------------- Retrieval --------------------
+    len_bm25_docs, len_semantic_docs, len_combined, retrieved_docs, retrieval_timings = retriever.retrieve(query, k_bm25=10, k_sem=10, top_n=rerank_candidates, filters=filters)
+    if filters and not retrieved_docs:
+        # the filter matched nothing useful: search the whole index instead
+        metadata["filters_relaxed"] = True
+        len_bm25_docs, len_semantic_docs, len_combined, retrieved_docs, retrieval_timings = retriever.retrieve(query, k_bm25=10, k_sem=10, top_n=rerank_candidates)
+    if retrieval_timings:
+        metadata["retrieval_timings"] = retrieval_timings
+    if retrieval_cache is not None and retrieved_docs and _filters_settled():
+        retrieval_cache.set(query, _hits(retrieved_docs, "rrf_score"), version=version, filters=filters, filters_relaxed=metadata.get("filters_relaxed", False))
+
+    # Add detailed breakdown
+    metadata["retriever"] = retriever.name
+    metadata["bm25_chunks"] = len_bm25_docs 
+    metadata["semantic_chunks"] = len_semantic_docs  
+    metadata["retrieved_chunks"] = len_combined
+    metadata["embedding_cache"] = dict(embedding_cache.stats, hit_rate=round(embedding_cache.hit_rate(), 3))
+
+    return None, retrieved_docs, query_vector, metadata
+
+
+async def _aprefetch(query: str):
+    """Async counterpart of _prefetch()."""
+    metadata = {}
+    query_vector = None
+    filters = _extract_filters(query, metadata)
+
+    # -------------------- Redis Caching --------------------
+    version = metadata["corpus_version"] = _serving_version(await corpus_versions.atag(_version_scope(filters)))
+    cached = await acache_get(query, async_redis_client, version=version, near=answer_near_cache)
+    _near_cache_stats(metadata)
+    if cached:
+        return cached, None, None, metadata
+
+    # -------------------- Semantic Caching --------------------
+    if semantic_cache is not None:
+        query_vector = await embedding_model.aembed_query(query)
+        cached = _semantic_lookup(query, query_vector, metadata)
+        if cached:
+            return cached, None, query_vector, metadata
+
+    # -------------------- Context / Retrieval Caches --------------------
+    retrieved_docs = await _acached_candidates(query, version, metadata)
+    if retrieved_docs is not None:
+        return None, retrieved_docs, query_vector, metadata
+
+    # -------------------- Retrieval --------------------
+    len_bm25_docs, len_semantic_docs, len_combined, retrieved_docs, retrieval_timings = await retriever.aretrieve(query, k_bm25=10, k_sem=10, top_n=rerank_candidates, filters=filters)
+    if filters and not retrieved_docs:
+        metadata["filters_relaxed"] = True
+        len_bm25_docs, len_semantic_docs, len_combined, retrieved_docs, retrieval_timings = await retriever.aretrieve(query, k_bm25=10, k_sem=10, top_n=rerank_candidates)
+    if retrieval_cache is not None and retrieved_docs and _filters_settled():
+        await retrieval_cache.aset(query, _hits(retrieved_docs, "rrf_score"), version=version, filters=filters, filters_relaxed=metadata.get("filters_relaxed", False))
+
+    metadata["retriever"] = retriever.name
+    metadata["bm25_chunks"] = len_bm25_docs
+    metadata["semantic_chunks"] = len_semantic_docs
+    metadata["retrieved_chunks"] = len_combined
+    metadata["retrieval_timings"] = retrieval_timings
+    metadata["embedding_cache"] = dict(embedding_cache.stats, hit_rate=round(embedding_cache.hit_rate(), 3))
+
+    return None, retrieved_docs, query_vector, metadata
+
+
+async def _aroute_and_prefetch(query: str, metadata: dict):
+    """
+    Route the query and, on the RAG path, run _aprefetch().
+    In speculative mode both start together and the prefetch task is
+    cancelled if the router picks "direct".
+    Returns (router_decision, prefetch result or None).
+    """
+    router_decision = _local_route(query, metadata)
+    if router_decision is not None:
+        # confident local decision: nothing to speculate about
+        if router_decision == "direct":
+            return router_decision, None
+        return router_decision, await _aprefetch(query)
+
+    if not speculative_retrieval:
+        router_decision = await aroute_query(query, router_llm, ROUTER_PROMPT)
+        if router_decision == "direct":
+            return router_decision, None
+        return router_decision, await _aprefetch(query)
+
+    prefetch_task = asyncio.create_task(_aprefetch(query))
+    try:
+        router_decision = await aroute_query(query, router_llm, ROUTER_PROMPT)
+    except BaseException:
+        prefetch_task.cancel()
+        raise
+
+    if router_decision == "direct":
+        prefetch_task.cancel()
+        _record_speculation(metadata, wasted=True)
+        return router_decision, None
+
+    _record_speculation(metadata, wasted=False)
+    return router_decision, await prefetch_task
+
+
 def main(query: str):
+    startup.wait()
+
     # Track metadata
     metadata = {}
 
@@ -34,51 +561,88 @@ def main(query: str):
         blocked_message = inbound["message"]
         metadata["guardrail_blocked"] = True
         metadata["guardrail_reason"] = inbound.get("reason", "Unknown")
+        metadata["guardrail_category"] = inbound.get("category")
         memory_set(session_id, query, blocked_message) 
         return blocked_message, metadata
     
     query = inbound["cleaned_query"]
 
     # -------------------- Router --------------------
-    router_decision = route_query(query, router_llm, ROUTER_PROMPT)
+    router_decision = _local_route(query, metadata)
+    prefetch = None
+
+    if router_decision is None:
+        # -------------------- Speculative Prefetch --------------------
+        if speculative_retrieval:
+            prefetch = _speculation_executor.submit(_prefetch, query)
+        router_decision = route_query(query, router_llm, ROUTER_PROMPT)
+
     metadata["router"] = router_decision
 
     if router_decision == "direct":
+        if prefetch is not None:
+            prefetch.cancel()  # no-op if already running, the result is simply dropped
+            _record_speculation(metadata, wasted=True)
+
         # -------------------- Memory (For Non RAG Questions) --------------------
-        memory_chain = build_memory_chain(generator_llm, get_chat_prompt())
+        # the chain saves this turn to session history itself
         assistant_response = generate_answer_chat_memory(query, session_id, memory_chain)
         metadata["generated"] = True
-        memory_set(session_id, query, assistant_response) 
-        return assistant_response, metadata
+        return outbound_check(assistant_response), metadata
+
+    if prefetch is not None:
+        _record_speculation(metadata, wasted=False)
+        cached, retrieved_docs, query_vector, prefetch_metadata = prefetch.result()
+    else:
+        cached, retrieved_docs, query_vector, prefetch_metadata = _prefetch(query)
+    metadata.update(prefetch_metadata)
 
-    # -------------------- Redis Caching --------------------
-    cached = cache_get(query, redis_client)
     if cached:
         print("CACHE HIT")
         metadata["cache"] = "hit"
         memory_set(session_id, query, cached) 
         return cached, metadata
     
-    print("CACHE MISS → Running full RAG pipeline...")
-    metadata["cache"] = "miss"
-
-    len_bm25_docs, len_semantic_docs, len_combined, retrieved_docs = retrieve_candidates_os(query, opensearch_client, embedding_model, opensearch_index_name, k_bm25=10, k_sem=10)
+    # -------------------- Single-flight --------------------
+    # identical concurrent misses wait for one leader instead of all generating
+    flight = single_flight.begin(query) if single_flight is not None else None
+    if flight is not None and not flight.leader:
+        cached, metadata["single_flight"] = flight.wait(partial(cache_get, version=metadata["corpus_version"], near=answer_near_cache), redis_client)
+        if cached:
+            print("CACHE HIT (coalesced)")
+            metadata["cache"] = "hit"
+            memory_set(session_id, query, cached)
+            return cached, metadata
 
-    # Add detailed breakdown
-    metadata["bm25_chunks"] = len_bm25_docs 
-    metadata["semantic_chunks"] = len_semantic_docs  
-    metadata["retrieved_chunks"] = len_combined
+    # prefetch already named the layer if the retrieval / context cache served the chunks
+    metadata.setdefault("cache", "miss")
+    print(f"CACHE {metadata['cache'].upper()} → Running RAG pipeline...")
 
+    try:
         # -------------------- Reranker --------------------
-    reranked_docs = rerank_documents(query, reranker, retrieved_docs, top_k=10)
-    metadata["reranked_chunks"] = len(reranked_docs)
+        if metadata["cache"] == "context_hit":
+            reranked_docs = retrieved_docs  # already reranked
+        elif _reranker_ready(metadata):
+            reranked_docs = rerank_documents(query, reranker, retrieved_docs, top_k=10, score_cache=rerank_score_cache)
+            if context_cache is not None and _filters_settled():
+                context_cache.set(query, _hits(reranked_docs, "rerank_score"), version=metadata["corpus_version"], filters=metadata["filters"])
+        else:
+            reranked_docs = retrieved_docs[:10]
+        metadata["reranked_chunks"] = len(reranked_docs)
+        metadata["rerank_cache"] = dict(rerank_score_cache.stats, hit_rate=round(rerank_score_cache.hit_rate(), 3))
 
-    # -------------------- Generator --------------------
-    context = build_context(reranked_docs)
-    assistant_response = generate_answer_rag(query, context, generator_llm, GENERATION_PROMPT)
-    metadata["generated"] = True
+        # -------------------- Generator --------------------
+        context = build_context(reranked_docs)
+        assistant_response = generate_answer_rag(query, context, generator_llm, GENERATION_PROMPT)
+        metadata["generated"] = True
     
-    cache_set(query, assistant_response, redis_client)
+        cache_set(query, assistant_response, redis_client, ttl=answer_cache_ttl, version=metadata["corpus_version"], near=answer_near_cache)
+    finally:
+        if flight is not None and flight.leader:
+            metadata["single_flight"] = flight.release()
+
+    if semantic_cache is not None and query_vector is not None:
+        _semantic_add(query, query_vector, assistant_response, metadata)
 
     # -------------------- Outbound Check - Guardrails --------------------
     safe_output = outbound_check(assistant_response)
@@ -89,6 +653,233 @@ def main(query: str):
     return safe_output, metadata
 
 
+async def amain(query: str):
+    """
+    Non-blocking version of main() with the same (response, metadata) contract.
+    Network calls use ainvoke / asyncio Redis / AsyncOpenSearch, and the
+    CPU-bound reranker runs in a thread pool so the event loop stays free.
+    """
+    await startup.await_ready()
+    metadata = {}
+
+    # -------------------- Inbound Check - Guardrails --------------------
+    inbound = inbound_check(query)
+    if inbound["status"] == "blocked":
+        blocked_message = inbound["message"]
+        metadata["guardrail_blocked"] = True
+        metadata["guardrail_reason"] = inbound.get("reason", "Unknown")
+        metadata["guardrail_category"] = inbound.get("category")
+        await amemory_set(session_id, query, blocked_message)
+        return blocked_message, metadata
+
+    query = inbound["cleaned_query"]
+
+    # -------------------- Router (+ speculative prefetch) --------------------
+    router_decision, prefetched = await _aroute_and_prefetch(query, metadata)
+    metadata["router"] = router_decision
+
+    if router_decision == "direct":
+        # -------------------- Memory (For Non RAG Questions) --------------------
+        # the chain saves this turn to session history itself
+        assistant_response = await agenerate_answer_chat_memory(query, session_id, memory_chain)
+        metadata["generated"] = True
+        return outbound_check(assistant_response), metadata
+
+    cached, retrieved_docs, query_vector, prefetch_metadata = prefetched
+    metadata.update(prefetch_metadata)
+
+    if cached:
+        print("CACHE HIT")
+        metadata["cache"] = "hit"
+        await amemory_set(session_id, query, cached)
+        return cached, metadata
+
+    # -------------------- Single-flight --------------------
+    flight = await single_flight.abegin(query) if single_flight is not None else None
+    if flight is not None and not flight.leader:
+        cached, metadata["single_flight"] = await flight.await_answer(partial(acache_get, version=metadata["corpus_version"], near=answer_near_cache), async_redis_client)
+        if cached:
+            print("CACHE HIT (coalesced)")
+            metadata["cache"] = "hit"
+            await amemory_set(session_id, query, cached)
+            return cached, metadata
+
+    # prefetch already named the layer if the retrieval / context cache served the chunks
+    metadata.setdefault("cache", "miss")
+    print(f"CACHE {metadata['cache'].upper()} → Running RAG pipeline...")
+
+    try:
+        # -------------------- Reranker --------------------
+        if metadata["cache"] == "context_hit":
+            reranked_docs = retrieved_docs  # already reranked
+        elif _reranker_ready(metadata):
+            reranked_docs = await arerank_documents(query, reranker, retrieved_docs, top_k=10, score_cache=rerank_score_cache)
+            if context_cache is not None and _filters_settled():
+                await context_cache.aset(query, _hits(reranked_docs, "rerank_score"), version=metadata["corpus_version"], filters=metadata["filters"])
+        else:
+            reranked_docs = retrieved_docs[:10]
+        metadata["reranked_chunks"] = len(reranked_docs)
+        metadata["rerank_cache"] = dict(rerank_score_cache.stats, hit_rate=round(rerank_score_cache.hit_rate(), 3))
+
+        # -------------------- Generator --------------------
+        context = build_context(reranked_docs)
+        assistant_response = await agenerate_answer_rag(query, context, generator_llm, GENERATION_PROMPT)
+        metadata["generated"] = True
+
+        await acache_set(query, assistant_response, async_redis_client, ttl=answer_cache_ttl, version=metadata["corpus_version"], near=answer_near_cache)
+    finally:
+        if flight is not None and flight.leader:
+            metadata["single_flight"] = await flight.arelease()
+
+    if semantic_cache is not None and query_vector is not None:
+        _semantic_add(query, query_vector, assistant_response, metadata)
+
+    # -------------------- Outbound Check - Guardrails --------------------
+    safe_output = outbound_check(assistant_response)
+
+    # -------------------- Save Output To Memory --------------------
+    await amemory_set(session_id, query, safe_output)
+
+    return safe_output, metadata
+
+
+async def _aguarded_tokens(stream, tokens: list):
+    """
+    ("token", text) events for an answer stream, released through OutboundStream;
+    the raw pieces are appended to `tokens`. If the text trips the outbound check
+    after part of it went out, one ("discard", ...) event tells the client to drop
+    it; the stream is still read to the end (the memory chain saves the turn then).
+    """
+    outbound = OutboundStream()
+    async for token in stream:
+        tokens.append(token)
+        if outbound.filtered:
+            continue
+        safe = outbound.feed(token)
+        if safe:
+            yield "token", safe
+        elif outbound.filtered:
+            yield "discard", {"reason": "outbound_filtered"}
+    tail = outbound.flush()
+    if tail:
+        yield "token", tail
+
+
+async def astream_main(query: str):
+    """
+    Streaming version of amain(). Yields (event, data) tuples:
+      ("metadata", dict)  once, before the first token
+      ("token", str)      for every generated piece of the answer (outbound-checked as it streams)
+      ("discard", dict)   at most once, if the answer trips the outbound check part-way:
+                          drop the tokens shown so far; no more tokens follow
+      ("done", dict)      once, with the final (outbound-checked) response
+    The full answer is still written to the answer cache and session memory
+    after the last token has been sent.
+    """
+    await startup.await_ready()
+    metadata = {}
+
+    # -------------------- Inbound Check - Guardrails --------------------
+    inbound = inbound_check(query)
+    if inbound["status"] == "blocked":
+        blocked_message = inbound["message"]
+        metadata["guardrail_blocked"] = True
+        metadata["guardrail_reason"] = inbound.get("reason", "Unknown")
+        metadata["guardrail_category"] = inbound.get("category")
+        yield "metadata", metadata
+        yield "token", blocked_message
+        await amemory_set(session_id, query, blocked_message)
+        yield "done", {"response": blocked_message}
+        return
+
+    query = inbound["cleaned_query"]
+
+    # -------------------- Router (+ speculative prefetch) --------------------
+    router_decision, prefetched = await _aroute_and_prefetch(query, metadata)
+    metadata["router"] = router_decision
+
+    if router_decision == "direct":
+        # -------------------- Memory (For Non RAG Questions) --------------------
+        metadata["generated"] = True
+        yield "metadata", metadata
+
+        tokens = []
+        async for event in _aguarded_tokens(astream_answer_chat_memory(query, session_id, memory_chain), tokens):
+            yield event
+
+        # the chain saves this turn to session history once the stream completes
+        yield "done", {"response": outbound_check("".join(tokens))}
+        return
+
+    cached, retrieved_docs, query_vector, prefetch_metadata = prefetched
+    metadata.update(prefetch_metadata)
+
+    if cached:
+        metadata["cache"] = "hit"
+        yield "metadata", metadata
+        yield "token", cached
+        await amemory_set(session_id, query, cached)
+        yield "done", {"response": cached}
+        return
+
+    # -------------------- Single-flight --------------------
+    flight = await single_flight.abegin(query) if single_flight is not None else None
+    if flight is not None and not flight.leader:
+        cached, metadata["single_flight"] = await flight.await_answer(partial(acache_get, version=metadata["corpus_version"], near=answer_near_cache), async_redis_client)
+        if cached:
+            metadata["cache"] = "hit"
+            yield "metadata", metadata
+            yield "token", cached
+            await amemory_set(session_id, query, cached)
+            yield "done", {"response": cached}
+            return
+
+    metadata.setdefault("cache", "miss")
+
+    flight_info = None
+    try:
+        # -------------------- Reranker --------------------
+        if metadata["cache"] == "context_hit":
+            reranked_docs = retrieved_docs  # already reranked
+        elif _reranker_ready(metadata):
+            reranked_docs = await arerank_documents(query, reranker, retrieved_docs, top_k=10, score_cache=rerank_score_cache)
+            if context_cache is not None and _filters_settled():
+                await context_cache.aset(query, _hits(reranked_docs, "rerank_score"), version=metadata["corpus_version"], filters=metadata["filters"])
+        else:
+            reranked_docs = retrieved_docs[:10]
+        metadata["reranked_chunks"] = len(reranked_docs)
+        metadata["rerank_cache"] = dict(rerank_score_cache.stats, hit_rate=round(rerank_score_cache.hit_rate(), 3))
+        metadata["generated"] = True
+        yield "metadata", metadata
+
+        # -------------------- Generator (streamed) --------------------
+        # -------------------- Outbound Check - Guardrails (as it streams) --------------------
+        context = build_context(reranked_docs)
+        tokens = []
+        async for event in _aguarded_tokens(astream_answer_rag(query, context, generator_llm, GENERATION_PROMPT), tokens):
+            yield event
+
+        assistant_response = "".join(tokens)
+        await acache_set(query, assistant_response, async_redis_client, ttl=answer_cache_ttl, version=metadata["corpus_version"], near=answer_near_cache)
+    finally:
+        if flight is not None and flight.leader:
+            # metadata is already on the wire; the leader's coalescing stats go out with "done"
+            flight_info = await flight.arelease()
+
+    if semantic_cache is not None and query_vector is not None:
+        _semantic_add(query, query_vector, assistant_response, metadata)
+
+    # the streamed tokens were masked / cut off by the same rules as outbound_check
+    safe_output = outbound_check(assistant_response)
+
+    # -------------------- Save Output To Memory --------------------
+    await amemory_set(session_id, query, safe_output)
+    done = {"response": safe_output}
+    if flight_info is not None:
+        done["single_flight"] = flight_info
+    yield "done", done
+
+
 if __name__ == "__main__":
     query1 = "Explain total revenue in 2024."
     response, metadata = main(query1)
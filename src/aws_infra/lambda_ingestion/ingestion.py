@@ -1,14 +1,23 @@
 import os
+import time
+import hashlib
+import multiprocessing
 import boto3
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from pypdf import PdfReader
 from opensearchpy import OpenSearch, RequestsHttpConnection
+from opensearchpy.helpers import scan
 from requests_aws4auth import AWS4Auth
 from urllib.parse import urlparse
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_core.documents import Document
 
+try:
+    import redis  # optional: only needed to invalidate the API's answer cache
+except ImportError:
+    redis = None
+
 
 # ------------------------
 # AWS Clients
@@ -16,6 +25,22 @@ from langchain_core.documents import Document
 s3 = boto3.client("s3")
 
 
+# ------------------------
+# Tuning (env overridable)
+# ------------------------
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "128"))        # chunks per embeddings request
+EMBED_MAX_TOKENS = int(os.getenv("EMBED_MAX_TOKENS", "100000"))     # token budget per embeddings request
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "4"))          # bulk requests in flight
+BULK_MAX_RETRIES = int(os.getenv("BULK_MAX_RETRIES", "3"))          # retries of failed items only
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "0")) or os.cpu_count() or 1  # PDF extraction processes
+EXTRACT_WINDOW_PAGES = int(os.getenv("EXTRACT_WINDOW_PAGES", "64"))  # pages extracted (and held) per window
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Same counters as CorpusVersions in src/caching.py: the API caches answers under
+# these versions, so bumping them after a successful index invalidates stale answers.
+CORPUS_VERSION_KEY = "{rag:corpus}:version"  # hash tag: one cluster slot for the MULTI
+
+
 # ------------------------
 # Helpers
 # ------------------------
@@ -44,25 +69,92 @@ def get_text_splitter():
     )
 
 
-def chunk_text(text: str, metadata: dict):
+def iter_chunks(pages, metadata: dict, seen_ids: set):
+    """
+    Split page by page (chunks keep their page number) and yield chunks with a
+    deterministic chunk_id. IDs are recorded in `seen_ids`; repeats are skipped.
+    """
     splitter = get_text_splitter()
-    doc = Document(page_content=text, metadata=metadata)
-    return splitter.split_documents([doc])
+    for page_number, text in pages:
+        doc = Document(page_content=text, metadata={**metadata, "page": page_number})
+        for chunk in splitter.split_documents([doc]):
+            cid = chunk_id(chunk.metadata["source"], chunk.page_content)
+            if cid in seen_ids:
+                continue
+            seen_ids.add(cid)
+            chunk.metadata["chunk_id"] = cid
+            yield chunk
+
+
+def _extract_page_range(pdf_path: str, start: int, end: int):
+    reader = PdfReader(pdf_path)
+    pages = []
+    for i in range(start, end):
+        page_text = reader.pages[i].extract_text()
+        if page_text:
+            pages.append((i, page_text))
+    return pages
+
 
+def _extract_worker(conn, pdf_path: str, start: int, end: int):
+    try:
+        conn.send(("ok", _extract_page_range(pdf_path, start, end)))
+    except Exception as e:
+        conn.send(("error", repr(e)))
+    finally:
+        conn.close()
 
-def extract_text_from_pdf(pdf_bytes: bytes) -> str:
+
+def _extract_ranges_parallel(pdf_path: str, ranges):
+    """
+    One process per page range, results returned in range order.
+    Uses Process + Pipe rather than Pool / ProcessPoolExecutor because Lambda
+    has no /dev/shm for the semaphores those need.
+    """
+    jobs = []
+    for start, end in ranges:
+        parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_extract_worker, args=(child_conn, pdf_path, start, end))
+        process.start()
+        child_conn.close()
+        jobs.append((process, parent_conn))
+
+    results = []
+    for process, conn in jobs:
+        status, payload = conn.recv()
+        process.join()
+        if status != "ok":
+            raise RuntimeError(f"PDF extraction worker failed: {payload}")
+        results.append(payload)
+    return results
+
+
+def iter_pages(pdf_path: str, workers: int = EXTRACT_WORKERS, window: int = EXTRACT_WINDOW_PAGES):
     """
-    Safe PDF text extraction using pypdf
+    Safe PDF text extraction using pypdf, streamed as (page_number, text) in page order.
+    The document is processed in windows of `window` pages; each window is split
+    across `workers` processes. Only one window of text is held at a time, so
+    memory does not grow with the size of the PDF.
     """
-    reader = PdfReader(BytesIO(pdf_bytes))
-    texts = []
+    total_pages = len(PdfReader(pdf_path).pages)
+
+    for window_start in range(0, total_pages, window):
+        window_end = min(window_start + window, total_pages)
+        n_workers = max(1, min(workers, window_end - window_start))
+
+        if n_workers == 1:
+            yield from _extract_page_range(pdf_path, window_start, window_end)
+            continue
+
+        step = -(-(window_end - window_start) // n_workers)  # ceil division
+        ranges = [(s, min(s + step, window_end)) for s in range(window_start, window_end, step)]
+        for pages in _extract_ranges_parallel(pdf_path, ranges):
+            yield from pages
 
-    for i, page in enumerate(reader.pages):
-        page_text = page.extract_text()
-        if page_text:
-            texts.append(page_text)
 
-    return "\n".join(texts)
+def extract_pages_from_pdf(pdf_path: str, workers: int = EXTRACT_WORKERS):
+    """All pages as a list: [(page_number, text), ...]."""
+    return list(iter_pages(pdf_path, workers))
 
 
 def get_embedding_model():
@@ -74,6 +166,135 @@ def get_embedding_model():
     )
 
 
+def chunk_id(source: str, content: str) -> str:
+    """Deterministic chunk ID: same source + same text always maps to the same document."""
+    return f"{source}:{hashlib.sha1(content.encode('utf-8')).hexdigest()}"
+
+
+def existing_chunk_ids(opensearch, index_name: str, source: str) -> set:
+    """IDs of everything already indexed for this source (ids only, no _source)."""
+    hits = scan(
+        opensearch,
+        index=index_name,
+        query={"query": {"term": {"source": source}}},
+        _source=False,
+        size=1000,
+    )
+    return {hit["_id"] for hit in hits}
+
+
+def bulk_delete(opensearch, index_name: str, ids) -> int:
+    ids = list(ids)
+    if not ids:
+        return 0
+    body = [{"delete": {"_index": index_name, "_id": i}} for i in ids]
+    response = opensearch.bulk(body=body)
+    return sum(1 for item in response["items"] if item["delete"].get("status") in (200, 404))
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; good enough for budgeting
+    return len(text) // 4 + 1
+
+
+def batch_chunks(chunks, batch_size: int = EMBED_BATCH_SIZE, max_tokens: int = EMBED_MAX_TOKENS):
+    """Group chunks so each embeddings request stays under both the size and token caps."""
+    batch, tokens = [], 0
+    for chunk in chunks:
+        chunk_tokens = estimate_tokens(chunk.page_content)
+        if batch and (len(batch) >= batch_size or tokens + chunk_tokens > max_tokens):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(chunk)
+        tokens += chunk_tokens
+    if batch:
+        yield batch
+
+
+def bulk_index(opensearch, index_name: str, documents, max_retries: int = BULK_MAX_RETRIES):
+    """
+    Index documents with one _bulk request, then retry only the items that
+    failed with a retryable status (429 / 5xx), with exponential backoff.
+    Returns (indexed_count, errors) where errors are the per-item failures left over.
+    """
+    pending = list(documents)
+    indexed = 0
+    errors = []
+
+    for attempt in range(max_retries + 1):
+        body = []
+        for doc in pending:
+            action = {"_index": index_name}
+            if "_id" in doc:
+                action["_id"] = doc["_id"]
+            body.append({"index": action})
+            body.append({k: v for k, v in doc.items() if k != "_id"})
+
+        response = opensearch.bulk(body=body)
+
+        retry = []
+        for doc, item in zip(pending, response["items"]):
+            result = item["index"]
+            status = result.get("status", 500)
+            if status < 300:
+                indexed += 1
+            elif status in RETRYABLE_STATUSES and attempt < max_retries:
+                retry.append(doc)
+            else:
+                errors.append({"source": doc.get("source"), "status": status, "error": result.get("error")})
+
+        if not retry:
+            break
+
+        print(f"🔁 Retrying {len(retry)} failed items (attempt {attempt + 1}/{max_retries})")
+        time.sleep(0.5 * 2 ** attempt)
+        pending = retry
+
+    return indexed, errors
+
+
+def embed_and_index(chunks, embedder, opensearch, index_name: str):
+    """
+    Embed chunks in batched embed_documents calls and write each batch with the
+    bulk API. Bulk requests run on a small pool (BULK_CONCURRENCY) so indexing of
+    batch N overlaps embedding of batch N+1; at most BULK_CONCURRENCY batches are
+    held in memory waiting to be written.
+    """
+    stats = {"indexed": 0, "errors": [], "embed_seconds": 0.0, "embed_requests": 0}
+    in_flight = []
+
+    def collect(future):
+        indexed, errors = future.result()
+        stats["indexed"] += indexed
+        stats["errors"].extend(errors)
+
+    with ThreadPoolExecutor(max_workers=BULK_CONCURRENCY) as pool:
+        for batch in batch_chunks(chunks):
+            t0 = time.perf_counter()
+            vectors = embedder.embed_documents([c.page_content for c in batch])
+            stats["embed_seconds"] += time.perf_counter() - t0
+            stats["embed_requests"] += 1
+
+            documents = []
+            for c, v in zip(batch, vectors):
+                doc = {"content": c.page_content, "embedding": v, **c.metadata}
+                cid = doc.pop("chunk_id", None)
+                if cid:
+                    doc["_id"] = cid
+                documents.append(doc)
+
+            # backpressure: wait for the oldest bulk request before queueing more
+            if len(in_flight) >= BULK_CONCURRENCY:
+                collect(in_flight.pop(0))
+            in_flight.append(pool.submit(bulk_index, opensearch, index_name, documents))
+            print(f"🔢 Embedded batch of {len(batch)} chunks ({stats['embed_requests']} requests so far)")
+
+        for future in in_flight:
+            collect(future)
+
+    return stats
+
+
 def get_opensearch_client():
     raw_host = os.getenv("OPENSEARCH_HOST")
     if not raw_host:
@@ -107,12 +328,41 @@ def get_opensearch_client():
     )
 
 
+def bump_corpus_version(company: str):
+    """
+    INCR the global and the company's corpus version. Skipped (None) without
+    ELASTICACHE_ENDPOINT; any Redis error is raised so the ingestion fails.
+    """
+    host = os.getenv("ELASTICACHE_ENDPOINT")
+    if not host or redis is None:
+        print("⚠️ ELASTICACHE_ENDPOINT not set (or redis not installed), corpus version not bumped")
+        return None
+
+    client = redis.Redis(
+        host=host,
+        port=6379,
+        db=0,
+        ssl=True,
+        ssl_cert_reqs=None,
+        socket_connect_timeout=5,
+        socket_timeout=5,
+    )
+    pipe = client.pipeline(transaction=True)
+    pipe.incr(CORPUS_VERSION_KEY)
+    pipe.incr(f"{CORPUS_VERSION_KEY}:{company}")
+    version = pipe.execute()[0]
+
+    print(f"🔖 Corpus version bumped to {version} ({company})")
+    return version
+
+
 # ------------------------
 # Lambda Handler
 # ------------------------
 def handler(event, context):
     print("🔥 Lambda handler started")
     print("Event received")
+    pdf_path = None
 
     try:
         record = event["Records"][0]
@@ -121,24 +371,13 @@ def handler(event, context):
 
         print(f"📄 Processing file: s3://{bucket}/{key}")
 
-        # 1️⃣ Download PDF
-        response = s3.get_object(Bucket=bucket, Key=key)
-        pdf_bytes = response["Body"].read()
-        print(f"⬇️ PDF downloaded ({len(pdf_bytes)} bytes)")
-
-        # 2️⃣ Extract text
-        text = extract_text_from_pdf(pdf_bytes)
-        if not text.strip():
-            raise ValueError("No text extracted from PDF")
-
-        print(f"📝 Extracted text length: {len(text)}")
+        # 1️⃣ Download PDF (streamed to /tmp instead of held in memory)
+        pdf_path = os.path.join("/tmp", os.path.basename(key))
+        s3.download_file(bucket, key, pdf_path)
+        print(f"⬇️ PDF downloaded ({os.path.getsize(pdf_path)} bytes)")
 
-        # 3️⃣ Metadata + chunking
+        # 2️⃣ Metadata + clients (created INSIDE handler)
         metadata = parse_metadata_from_filename(os.path.basename(key))
-        chunks = chunk_text(text, metadata)
-        print(f"✂️ Created {len(chunks)} chunks")
-
-        # 4️⃣ Clients (created INSIDE handler)
         embedder = get_embedding_model()
         opensearch = get_opensearch_client()
         index_name = os.getenv("OPENSEARCH_INDEX")
@@ -146,32 +385,69 @@ def handler(event, context):
         if not index_name:
             raise ValueError("OPENSEARCH_INDEX env var not set")
 
-        # 5️⃣ Embed + index
-        for i, chunk in enumerate(chunks):
-            print(f"🔢 Embedding chunk {i + 1}/{len(chunks)}")
+        # 3️⃣ What is already indexed for this file (ids only)
+        existing_ids = existing_chunk_ids(opensearch, index_name, metadata["source"])
+
+        # 4️⃣ Stream: pages -> chunks -> new chunks only -> embedding batches -> bulk writes
+        #    Nothing below materializes the whole document; memory is bounded by one
+        #    extraction window plus BULK_CONCURRENCY embedded batches.
+        current_ids = set()
+        pages = iter_pages(pdf_path)
+        chunks = iter_chunks(pages, metadata, current_ids)
+        new_chunks = (c for c in chunks if c.metadata["chunk_id"] not in existing_ids)
 
-            vector = embedder.embed_query(chunk.page_content)
+        start = time.perf_counter()
+        stats = embed_and_index(new_chunks, embedder, opensearch, index_name)
+        elapsed = time.perf_counter() - start
+
+        if not current_ids:
+            raise ValueError("No text extracted from PDF")
 
-            document = {
-                "content": chunk.page_content,
-                "embedding": vector,
-                **chunk.metadata,
-            }
+        stale_ids = existing_ids - current_ids
+        unchanged = len(current_ids & existing_ids)
+        print(f"🧮 {stats['indexed']} added, {unchanged} unchanged, {len(stale_ids)} stale chunks")
 
-            opensearch.index(
-                index=index_name,
-                body=document,
-            )
+        # 5️⃣ Remove chunks that are no longer in the file (only once the new ones are in)
+        removed = bulk_delete(opensearch, index_name, stale_ids) if not stats["errors"] else 0
+
+        if stats["errors"]:
+            print(f"⚠️ {len(stats['errors'])} chunks failed to index")
+            for error in stats["errors"][:10]:
+                print(error)
+
+        # 6️⃣ Invalidate cached answers for this corpus (only if something actually changed)
+        corpus_version = None
+        if stats["indexed"] or removed:
+            # make the new chunks searchable first, or answers cached under the new version could miss them
+            opensearch.indices.refresh(index=index_name)
+            # a failed bump would leave stale answers cached for days: fail the invocation
+            # (S3 retries it, and the re-run is a no-op for the index apart from the bump)
+            corpus_version = bump_corpus_version(metadata["company"])
 
         print("✅ Ingestion completed successfully")
 
         return {
-            "status": "success",
+            "status": "success" if not stats["errors"] else "partial",
             "file": key,
-            "chunks_indexed": len(chunks),
+            "chunks_total": len(current_ids),
+            "chunks_added": stats["indexed"],
+            "chunks_unchanged": unchanged,
+            "chunks_removed": removed,
+            "chunks_indexed": stats["indexed"],
+            "chunks_failed": len(stats["errors"]),
+            "errors": stats["errors"][:10],
+            "embed_requests": stats["embed_requests"],
+            "embed_seconds": round(stats["embed_seconds"], 2),
+            "elapsed_seconds": round(elapsed, 2),
+            "chunks_per_sec": round(stats["indexed"] / elapsed, 2) if elapsed else 0.0,
+            "corpus_version": corpus_version,
         }
 
     except Exception as e:
         print("❌ ERROR during ingestion")
         print(str(e))
-        raise
\ No newline at end of file
+        raise
+
+    finally:
+        if pdf_path and os.path.exists(pdf_path):
+            os.remove(pdf_path)
\ No newline at end of file
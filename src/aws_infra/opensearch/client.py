@@ -5,6 +5,7 @@ import boto3
 from urllib.parse import urlparse
 from requests_aws4auth import AWS4Auth
 from opensearchpy import OpenSearch, RequestsHttpConnection
+from opensearchpy import AsyncOpenSearch, AsyncHttpConnection, AWSV4SignerAsyncAuth
 
 
 def get_opensearch_client():
@@ -34,4 +35,43 @@ def get_opensearch_client():
         timeout=60,
         max_retries=3,
         retry_on_timeout=True,
-    )
\ No newline at end of file
+        # parallel retrieval legs share this client, keep enough pooled connections
+        pool_maxsize=int(os.getenv("OPENSEARCH_POOL_MAXSIZE", "20")),
+    )
+
+
+def get_async_opensearch_client():
+    """AsyncOpenSearch (aiohttp) client for the async query pipeline."""
+    raw_host = os.getenv("OPENSEARCH_HOST")
+    if not raw_host:
+        raise RuntimeError("OPENSEARCH_HOST not set")
+
+    parsed = urlparse(raw_host if raw_host.startswith("http") else f"https://{raw_host}")
+    host = parsed.hostname
+    port = parsed.port or 443
+
+    region = os.getenv("AWS_REGION")
+    access_key = os.getenv("AWS_ACCESS_KEY_ID")
+    secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
+
+    if not all([region, access_key, secret_key]):
+        raise RuntimeError("AWS credentials or region not set in environment variables")
+
+    credentials = boto3.Session(
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        region_name=region,
+    ).get_credentials()
+    awsauth = AWSV4SignerAsyncAuth(credentials, region, "es")
+
+    return AsyncOpenSearch(
+        hosts=[{"host": host, "port": port}],
+        http_auth=awsauth,
+        use_ssl=True,
+        verify_certs=True,
+        connection_class=AsyncHttpConnection,
+        timeout=60,
+        max_retries=3,
+        retry_on_timeout=True,
+        pool_maxsize=int(os.getenv("OPENSEARCH_POOL_MAXSIZE", "20")),
+    )
@@ -0,0 +1,135 @@
+"""
+Array-backed BM25 inverted index for the local retrieval path.
+
+Built by src/ingestion_local.py from the chunk store and saved next to the
+FAISS index in <index_dir>/bm25/:
+
+    vocab.json        term -> term id
+    meta.json         k1, b, doc count, average doc length
+    idf.npy           float32 [n_terms]
+    term_offsets.npy  int64 [n_terms + 1]; postings of term t are [offsets[t], offsets[t + 1])
+    postings_doc.npy  int32 chunk-store rows, ascending within a term
+    postings_w.npy    float32 BM25 term-frequency weight, length-normalised at build time
+
+Since the per-posting weight already folds in tf, k1, b and the document length,
+scoring a query is one idf-weighted scatter-add per query term.
+"""
+import os
+import re
+import json
+import numpy as np
+
+BM25_DIR = "bm25"
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    # close to OpenSearch's standard analyzer: lowercase word tokens, no stemming or stopwords
+    return _TOKEN_RE.findall(text.lower())
+
+
+def build_bm25_index(chunk_store, save_dir, k1=1.2, b=0.75):
+    """Index every row of `chunk_store` (a src.chunk_store.ChunkStore) and save it under save_dir/bm25."""
+    vocab = {}
+    postings = []  # term id -> [(row, tf), ...]
+    doc_len = np.zeros(len(chunk_store), dtype=np.float32)
+
+    for row in range(len(chunk_store)):
+        counts = {}
+        tokens = tokenize(chunk_store.record(row)["content"])
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        doc_len[row] = len(tokens)
+
+        for token, tf in counts.items():
+            term_id = vocab.get(token)
+            if term_id is None:
+                term_id = vocab[token] = len(postings)
+                postings.append([])
+            postings[term_id].append((row, tf))
+
+    n_docs = len(chunk_store)
+    avgdl = float(doc_len.mean()) if n_docs else 0.0
+
+    offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(p) for p in postings])
+    postings_doc = np.empty(offsets[-1], dtype=np.int32)
+    postings_tf = np.empty(offsets[-1], dtype=np.float32)
+    for term_id, plist in enumerate(postings):
+        start, end = offsets[term_id], offsets[term_id + 1]
+        postings_doc[start:end] = [row for row, _ in plist]
+        postings_tf[start:end] = [tf for _, tf in plist]
+
+    df = np.diff(offsets).astype(np.float32)
+    idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+    norm = k1 * (1 - b + b * doc_len[postings_doc] / (avgdl or 1.0))
+    postings_w = (postings_tf * (k1 + 1) / (postings_tf + norm)).astype(np.float32)
+
+    out_dir = os.path.join(save_dir, BM25_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    # a running server has these files memory-mapped: write them aside and rename,
+    # never truncate in place. meta.json goes last since exists() keys off it.
+    arrays = {"idf.npy": idf, "term_offsets.npy": offsets, "postings_doc.npy": postings_doc, "postings_w.npy": postings_w}
+    for name, array in arrays.items():
+        with open(os.path.join(out_dir, name + ".tmp"), "wb") as f:
+            np.save(f, array)
+    with open(os.path.join(out_dir, "vocab.json.tmp"), "w") as f:
+        json.dump(vocab, f, ensure_ascii=False)
+    with open(os.path.join(out_dir, "meta.json.tmp"), "w") as f:
+        json.dump({"k1": k1, "b": b, "n_docs": n_docs, "avgdl": avgdl}, f)
+    for name in [*arrays, "vocab.json", "meta.json"]:
+        os.replace(os.path.join(out_dir, name + ".tmp"), os.path.join(out_dir, name))
+
+    print(f"BM25 index written: {n_docs} chunks, {len(vocab)} terms, {len(postings_doc)} postings")
+    return n_docs
+
+
+class BM25Index:
+    """Memory-mapped BM25 index; search() returns chunk-store rows with scores."""
+
+    def __init__(self, index_dir):
+        bm25_dir = os.path.join(index_dir, BM25_DIR)
+        with open(os.path.join(bm25_dir, "vocab.json")) as f:
+            self.vocab = json.load(f)
+        with open(os.path.join(bm25_dir, "meta.json")) as f:
+            self.meta = json.load(f)
+
+        self.idf = np.load(os.path.join(bm25_dir, "idf.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(bm25_dir, "term_offsets.npy"), mmap_mode="r")
+        self.postings_doc = np.load(os.path.join(bm25_dir, "postings_doc.npy"), mmap_mode="r")
+        self.postings_w = np.load(os.path.join(bm25_dir, "postings_w.npy"), mmap_mode="r")
+        self.n_docs = self.meta["n_docs"]
+
+    @staticmethod
+    def exists(index_dir):
+        return os.path.exists(os.path.join(index_dir, BM25_DIR, "meta.json"))
+
+    def search(self, query, k=10, rows=None):
+        """
+        Top-k (row, score) pairs, best first; only documents sharing a term with the query.
+        rows: optional sorted array of chunk-store rows to restrict the search to (metadata filter).
+        """
+        term_ids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not term_ids:
+            return []
+
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # rows are unique within a term, so fancy-index += is safe here
+            scores[self.postings_doc[start:end]] += self.idf[term_id] * self.postings_w[start:end]
+
+        if rows is not None:
+            matched = rows[np.flatnonzero(scores[rows])]
+        else:
+            matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(scores[matched], -k)[-k:]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(row), float(scores[row])) for row in matched]
+
+
+def bm25_retrieve_local(query, bm25_index, chunk_store, k=10, rows=None):
+    """Local counterpart of retrieval.bm25_retrieve_os: same Document shape, score = BM25 score."""
+    return [chunk_store.get(row, score=score) for row, score in bm25_index.search(query, k, rows)]
@@ -1,6 +1,17 @@
 import redis
+import redis.asyncio as aioredis
 import re
 import os
+import time
+import json
+import zlib
+import uuid
+import asyncio
+import hashlib
+import threading
+import numpy as np
+from array import array
+from collections import OrderedDict
 from typing import Optional
 
 def load_redis_client():
@@ -29,6 +40,37 @@ def load_redis_client():
     return client
 
 
+def load_async_redis_client(decode_responses: bool = True):
+    """asyncio Redis client with the same ElastiCache settings as load_redis_client."""
+    host = os.getenv("ELASTICACHE_ENDPOINT")
+    if not host:
+        raise RuntimeError("ELASTICACHE_ENDPOINT not set")
+
+    return aioredis.Redis(
+        host=host,
+        port=6379,
+        db=0,
+        decode_responses=decode_responses,
+        ssl=True,
+        ssl_cert_reqs=None,
+        socket_connect_timeout=5,
+        socket_timeout=5,
+    )
+
+
+def get_binary_client(redis_client):
+    """
+    Return a client on the same host that does NOT decode responses.
+    Needed for values stored as raw bytes (e.g. embedding vectors).
+    """
+    pool = redis_client.connection_pool
+    kwargs = dict(pool.connection_kwargs)
+    kwargs["decode_responses"] = False
+    return redis.Redis(
+        connection_pool=redis.ConnectionPool(connection_class=pool.connection_class, **kwargs)
+    )
+
+
 
 def normalize_query(query: str) -> str:
     """Normalize query for consistent cache keys"""
@@ -38,13 +80,893 @@ def normalize_query(query: str) -> str:
     return q
 
 
-def cache_get(query: str, redis_client) -> Optional[str]:
-    """Get cached response for a query."""
-    key = f"rag:query:{normalize_query(query)}"
-    return redis_client.get(key)
+def _answer_key(query: str, version: str = None) -> str:
+    if version:
+        return f"rag:query:{version}:{normalize_query(query)}"
+    return f"rag:query:{normalize_query(query)}"
+
+
+def cache_get(query: str, redis_client, version: str = None, near=None) -> Optional[str]:
+    """Get cached response for a query (under a corpus version tag, if given), near cache first."""
+    key = _answer_key(query, version)
+    if near is None:
+        return redis_client.get(key)
+
+    answer = near.get(key)
+    if answer is None:
+        # same round trip as a plain GET; the local copy expires with the Redis key
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.pttl(key)
+        answer, pttl = pipe.execute()
+        if answer:
+            near.set(key, answer, pttl / 1000)
+    return answer
+
+
+def cache_set(query: str, answer: str, redis_client, ttl: int = 3600, version: str = None, near=None):
+    """Cache a query-answer pair (write-through to the near cache, if given)."""
+    key = _answer_key(query, version)
+    redis_client.setex(key, ttl, answer)
+    if near is not None:
+        near.set(key, answer, ttl)
+
+
+async def acache_get(query: str, async_redis_client, version: str = None, near=None) -> Optional[str]:
+    """Async variant of cache_get."""
+    key = _answer_key(query, version)
+    if near is None:
+        return await async_redis_client.get(key)
+
+    answer = near.get(key)
+    if answer is None:
+        async with async_redis_client.pipeline(transaction=False) as pipe:
+            pipe.get(key)
+            pipe.pttl(key)
+            answer, pttl = await pipe.execute()
+        if answer:
+            near.set(key, answer, pttl / 1000)
+    return answer
+
+
+async def acache_set(query: str, answer: str, async_redis_client, ttl: int = 3600, version: str = None, near=None):
+    """Async variant of cache_set."""
+    key = _answer_key(query, version)
+    await async_redis_client.setex(key, ttl, answer)
+    if near is not None:
+        near.set(key, answer, ttl)
+
+
+# ---------------- NEAR CACHE ----------------
+
+class NearCache:
+    """
+    Bounded in-process copy of hot Redis keys (answers, session history windows),
+    so repeated reads skip the TLS round trip to ElastiCache.
+    Each entry expires with its Redis key, capped at `max_ttl` (which bounds how
+    stale a copy can get if an invalidation is missed); expired entries go first,
+    then the least recently used once `max_entries` is reached.
+    Writers update it write-through. Writers that other processes must hear
+    about PUBLISH message(key) on `channel` (e.g. inside their write pipeline);
+    listen() drops those keys locally. Own messages are ignored.
+    """
+
+    def __init__(self, name: str, max_entries: int = 10000, max_ttl: float = 30.0, channel: str = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.channel = channel or f"rag:near:{name}"
+        self.node = uuid.uuid4().hex[:12]
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value, ttl: float = None):
+        """ttl: seconds the Redis key has left (None / negative = no expiry there)."""
+        ttl = self.max_ttl if ttl is None or ttl <= 0 else min(ttl, self.max_ttl)
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (value, now + ttl)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._evict(now)
+
+    def _evict(self, now):
+        if now >= self._next_sweep:
+            # expired entries go first; the full pass runs at most once a second
+            for k in [k for k, (_, expires_at) in self._entries.items() if expires_at <= now]:
+                del self._entries[k]
+            self._next_sweep = now + 1.0
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, key: str = None):
+        """Drop one key locally (all keys if None)."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            elif self._entries.pop(key, None) is None:
+                return
+            self.stats["invalidations"] += 1
+
+    def message(self, key: str) -> str:
+        return f"{self.node}:{key}"
+
+    def listen(self, redis_client):
+        """Drop keys published by other processes on `channel`. Runs on a daemon thread."""
+        def _loop():
+            while True:
+                pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                try:
+                    pubsub.subscribe(self.channel)
+                    while True:
+                        msg = pubsub.get_message(timeout=1.0)
+                        if msg is None:
+                            continue
+                        node, _, key = msg["data"].partition(":")
+                        if node != self.node:
+                            self.invalidate(key)
+                except Exception as e:
+                    # invalidations may have been missed while disconnected
+                    print(f"⚠️ Near cache '{self.name}' listener reconnecting: {e}")
+                    self.invalidate()
+                    time.sleep(1.0)
+                finally:
+                    pubsub.close()
+
+        threading.Thread(target=_loop, name=f"near-cache-{self.name}", daemon=True).start()
+        return self
+
+    def hit_rate(self) -> float:
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+
+# ---------------- CORPUS VERSIONS ----------------
+
+# INCR'd by the ingestion paths (Lambda handler, src/ingestion_local.py) whenever
+# they change the index: the global counter always, plus one per company touched.
+# All of them share the {rag:corpus} hash tag, so on a cluster-mode Redis
+# (ElastiCache Serverless) the MULTI in bump_corpus_version and the MGET in
+# CorpusVersions hit one slot instead of failing with CROSSSLOT.
+CORPUS_VERSION_KEY = "{rag:corpus}:version"
+
+
+def corpus_version_keys(companies=()):
+    return [CORPUS_VERSION_KEY] + [f"{CORPUS_VERSION_KEY}:{c}" for c in companies]
+
+
+def bump_corpus_version(redis_client, companies=()) -> int:
+    """Increment the global (and the given companies') corpus version; returns the new global version."""
+    pipe = redis_client.pipeline(transaction=True)
+    for key in corpus_version_keys(sorted(set(companies))):
+        pipe.incr(key)
+    return pipe.execute()[0]
+
+
+class CorpusVersions:
+    """
+    Read side of the corpus version counters. tag() returns the namespace that
+    answer-cache keys are stored under: the versions of the companies a query is
+    scoped to, or the global version for unscoped queries. A re-ingest moves the
+    namespace, so cached answers can live for days and still stop being served
+    exactly when the documents behind them change.
+    Versions are cached in-process for `ttl` seconds (one MGET per refresh), which
+    bounds how long a process keeps serving the previous version.
+    """
+
+    def __init__(self, redis_client, async_redis_client=None, ttl: float = 5.0):
+        self.redis = redis_client
+        self.async_redis = async_redis_client
+        self.ttl = ttl
+        self._versions = {}  # redis key -> (version, fetched_at)
+        self._lock = threading.Lock()
+
+    def _fresh(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            found = {k: self._versions[k][0] for k in keys if k in self._versions and now - self._versions[k][1] < self.ttl}
+        return found, [k for k in keys if k not in found]
+
+    def _store(self, keys, values, found):
+        now = time.monotonic()
+        with self._lock:
+            for key, value in zip(keys, values):
+                found[key] = int(value or 0)  # never bumped = version 0
+                self._versions[key] = (found[key], now)
+
+    @staticmethod
+    def _tag(found, companies):
+        if not companies:
+            return f"v{found[CORPUS_VERSION_KEY]}"
+        return "c:" + ",".join(f"{c}@{found[f'{CORPUS_VERSION_KEY}:{c}']}" for c in companies)
+
+    def tag(self, companies=()) -> str:
+        companies = sorted(set(companies))
+        found, missing = self._fresh(corpus_version_keys(companies))
+        if missing:
+            self._store(missing, self.redis.mget(missing), found)
+        return self._tag(found, companies)
+
+    async def atag(self, companies=()) -> str:
+        companies = sorted(set(companies))
+        found, missing = self._fresh(corpus_version_keys(companies))
+        if missing:
+            self._store(missing, await self.async_redis.mget(missing), found)
+        return self._tag(found, companies)
+
+    def version(self) -> int:
+        """The global version, fetched like tag()."""
+        found, missing = self._fresh([CORPUS_VERSION_KEY])
+        if missing:
+            self._store(missing, self.redis.mget(missing), found)
+        return found[CORPUS_VERSION_KEY]
+
+    def last_version(self):
+        """The global version as of the last tag() / version() call, without a Redis round trip; None before the first."""
+        with self._lock:
+            entry = self._versions.get(CORPUS_VERSION_KEY)
+        return entry[0] if entry else None
+
+
+# ---------------- SINGLE-FLIGHT (MISS COALESCING) ----------------
+
+# delete the lock only if we still own it (it may have expired and been re-taken)
+_RELEASE_LOCK_LUA = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class Flight:
+    """
+    One request's part in a single-flight group, returned by SingleFlight.begin().
+    leader=True: do the work, cache the answer, then release().
+    leader=False: wait() / await await_answer() for the leader's cached answer;
+    None means the leader failed or timed out and the caller should do the work itself.
+    """
+
+    def __init__(self, group, query, key, leader, event, token=None, remote=False):
+        self.group = group
+        self.query = query
+        self.key = key
+        self.leader = leader
+        self.event = event
+        self.token = token
+        self.remote = remote  # leader is in another process: poll Redis
+        self.wait_ms = 0.0
+
+    def _metadata(self, answer=None):
+        info = {"role": "leader" if self.leader else "follower", "lock_wait_ms": round(self.wait_ms, 1)}
+        if self.leader:
+            info["coalesced"] = self.group._followers.get(self.key, 0)
+        else:
+            # no answer: the leader failed or wait_timeout passed, the caller does the work itself
+            info["fell_back"] = answer is None
+        return info
+
+    def wait(self, cache_get_fn, redis_client):
+        start = time.perf_counter()
+        answer = None
+        deadline = start + self.group.wait_timeout
+
+        if not self.remote:
+            self.event.wait(self.group.wait_timeout)
+            answer = cache_get_fn(self.query, redis_client)
+        else:
+            while time.perf_counter() < deadline:
+                answer = cache_get_fn(self.query, redis_client)
+                if answer:
+                    break
+                if not self.group.redis.exists(self.group._lock_key(self.key)):
+                    # released between the two reads, or the leader gave up
+                    answer = cache_get_fn(self.query, redis_client)
+                    break
+                time.sleep(self.group.poll_interval)
+            self.group._finish_local(self.key)
+
+        return self._after_wait(start, answer)
+
+    async def await_answer(self, acache_get_fn, async_redis_client):
+        start = time.perf_counter()
+        answer = None
+        deadline = start + self.group.wait_timeout
+
+        while time.perf_counter() < deadline:
+            if not self.remote:
+                if self.event.is_set():
+                    break
+            else:
+                answer = await acache_get_fn(self.query, async_redis_client)
+                if answer or not await self.group.async_redis.exists(self.group._lock_key(self.key)):
+                    break
+            await asyncio.sleep(self.group.poll_interval)
+
+        answer = answer or await acache_get_fn(self.query, async_redis_client)
+        if self.remote:
+            self.group._finish_local(self.key)
+        return self._after_wait(start, answer)
+
+    def _after_wait(self, start, answer):
+        self.wait_ms = (time.perf_counter() - start) * 1000
+        with self.group._lock:
+            stats = self.group.stats
+            stats["coalesced" if answer else "fallbacks"] += 1
+        return answer, self._metadata(answer)
+
+    def release(self):
+        """Leader only: drop the Redis lock and wake local followers. Returns metadata."""
+        if self.token is not None and self.group.redis is not None:
+            try:
+                self.group.redis.eval(_RELEASE_LOCK_LUA, 1, self.group._lock_key(self.key), self.token)
+            except Exception as e:
+                print(f"⚠️ single-flight unlock failed (expires in {self.group.lock_ttl_ms} ms): {e}")
+        info = self._metadata()
+        self.group._finish_local(self.key)
+        return info
+
+    async def arelease(self):
+        if self.token is not None and self.group.async_redis is not None:
+            try:
+                await self.group.async_redis.eval(_RELEASE_LOCK_LUA, 1, self.group._lock_key(self.key), self.token)
+            except Exception as e:
+                print(f"⚠️ single-flight unlock failed (expires in {self.group.lock_ttl_ms} ms): {e}")
+        info = self._metadata()
+        self.group._finish_local(self.key)
+        return info
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent answer-cache misses for the same normalized query.
+    Within a process the first request becomes leader and the rest wait on an
+    Event (no Redis traffic). Across processes / hosts the local leader must
+    also win a short Redis lock (SET NX PX); if another process holds it, this
+    process's requests poll the answer cache until it appears, the lock
+    disappears or wait_timeout passes.
+    """
+
+    def __init__(self, redis_client=None, async_redis_client=None, lock_ttl_ms: int = 60000, wait_timeout: float = 30.0, poll_interval: float = 0.05):
+        self.redis = redis_client
+        self.async_redis = async_redis_client
+        self.lock_ttl_ms = lock_ttl_ms
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._local = {}  # key -> Event set when the in-process flight finishes
+        self._followers = {}  # key -> number of local requests waiting on it
+        self.stats = {"leaders": 0, "coalesced": 0, "fallbacks": 0}
+
+    def _lock_key(self, key: str) -> str:
+        return f"rag:lock:{key}"
+
+    def _join_local(self, key):
+        """(event, is_local_leader)"""
+        with self._lock:
+            event = self._local.get(key)
+            if event is not None:
+                self._followers[key] = self._followers.get(key, 0) + 1
+                return event, False
+            event = self._local[key] = threading.Event()
+            self._followers[key] = 0
+            return event, True
+
+    def _finish_local(self, key):
+        with self._lock:
+            event = self._local.pop(key, None)
+            self._followers.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def _as_leader(self, query, key, event, token):
+        with self._lock:
+            self.stats["leaders"] += 1
+        return Flight(self, query, key, leader=True, event=event, token=token)
+
+    def begin(self, query: str) -> Flight:
+        key = normalize_query(query)
+        event, local_leader = self._join_local(key)
+        if not local_leader:
+            return Flight(self, query, key, leader=False, event=event)
+
+        if self.redis is None:
+            return self._as_leader(query, key, event, None)
+        token = uuid.uuid4().hex
+        if self.redis.set(self._lock_key(key), token, nx=True, px=self.lock_ttl_ms):
+            return self._as_leader(query, key, event, token)
+        return Flight(self, query, key, leader=False, event=event, remote=True)
+
+    async def abegin(self, query: str) -> Flight:
+        key = normalize_query(query)
+        event, local_leader = self._join_local(key)
+        if not local_leader:
+            return Flight(self, query, key, leader=False, event=event)
+
+        if self.async_redis is None:
+            return self._as_leader(query, key, event, None)
+        token = uuid.uuid4().hex
+        if await self.async_redis.set(self._lock_key(key), token, nx=True, px=self.lock_ttl_ms):
+            return self._as_leader(query, key, event, token)
+        return Flight(self, query, key, leader=False, event=event, remote=True)
+
+
+# ---------------- EMBEDDING CACHE ----------------
+
+class EmbeddingCache:
+    """
+    Two-tier cache for query embeddings.
+    Tier 1 is a bounded in-process LRU, tier 2 is Redis holding packed float32 bytes.
+    Keys are model name + normalized query, so trivially different phrasings share a vector.
+    """
+
+    def __init__(self, redis_client=None, max_entries: int = 2048, ttl: int = 7 * 86400, async_redis_client=None):
+        self.redis = redis_client  # must be a binary (non-decoding) client
+        self.async_redis = async_redis_client  # optional, also binary
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"local_hits": 0, "redis_hits": 0, "misses": 0}
+
+    def _key(self, model: str, query: str) -> str:
+        return f"rag:emb:{model}:{normalize_query(query)}"
+
+    def _remember(self, key: str, vector):
+        with self._lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def get(self, model: str, query: str):
+        key = self._key(model, query)
+
+        vector = self._local_get(key)
+        if vector is not None:
+            return vector
+
+        if self.redis is not None:
+            raw = self.redis.get(key)
+            if raw:
+                vector = array("f", raw).tolist()
+                self._remember(key, vector)
+                with self._lock:
+                    self.stats["redis_hits"] += 1
+                return vector
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def set(self, model: str, query: str, vector):
+        key = self._key(model, query)
+        self._remember(key, list(vector))
+        if self.redis is not None:
+            self.redis.setex(key, self.ttl, array("f", vector).tobytes())
+
+    def _local_get(self, key: str):
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+                self.stats["local_hits"] += 1
+            return vector
+
+    async def aget(self, model: str, query: str):
+        key = self._key(model, query)
+
+        vector = self._local_get(key)
+        if vector is not None:
+            return vector
+
+        if self.async_redis is not None:
+            raw = await self.async_redis.get(key)
+            if raw:
+                vector = array("f", raw).tolist()
+                self._remember(key, vector)
+                with self._lock:
+                    self.stats["redis_hits"] += 1
+                return vector
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    async def aset(self, model: str, query: str, vector):
+        key = self._key(model, query)
+        self._remember(key, list(vector))
+        if self.async_redis is not None:
+            await self.async_redis.setex(key, self.ttl, array("f", vector).tobytes())
+
+    def hit_rate(self) -> float:
+        hits = self.stats["local_hits"] + self.stats["redis_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+
+class CachedEmbeddings:
+    """
+    Drop-in wrapper around a LangChain embedder that serves embed_query from an EmbeddingCache.
+    Document embeddings (ingestion) are passed straight through.
+    """
+
+    def __init__(self, embedder, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.cache = cache
+        self.model = getattr(embedder, "model", "default")
+
+    def embed_query(self, text: str):
+        vector = self.cache.get(self.model, text)
+        if vector is None:
+            vector = self.embedder.embed_query(text)
+            self.cache.set(self.model, text, vector)
+        return vector
+
+    async def aembed_query(self, text: str):
+        vector = await self.cache.aget(self.model, text)
+        if vector is None:
+            vector = await self.embedder.aembed_query(text)
+            await self.cache.aset(self.model, text, vector)
+        return vector
+
+    def embed_documents(self, texts):
+        return self.embedder.embed_documents(texts)
+
+
+
+# ---------------- SEMANTIC ANSWER CACHE ----------------
+
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def filter_scope(filters: dict = None) -> str:
+    """Canonical string for applied query filters: "company=Apple;year=2023", "" for none."""
+    return ";".join(f"{field}={','.join(map(str, values))}" for field, values in sorted((filters or {}).items()))
+
+
+def semantic_guard(query: str, filters: dict = None) -> str:
+    """
+    What a cached query must share exactly with a new one before its answer can be
+    reused: the extracted filters and every number in the text. "Apple revenue 2023"
+    and "Apple revenue 2024" embed almost identically but need different answers.
+    """
+    numbers = ",".join(sorted(set(_NUMBER_RE.findall(query))))
+    return f"{filter_scope(filters)}|{numbers}"
+
+
+class SemanticCache:
+    """
+    Nearest-neighbour answer cache over past query embeddings.
+    Vectors live in one preallocated float32 matrix (unit-normalized), so a lookup
+    is a single matrix-vector product; at 3072 dimensions every 1000 entries cost
+    12 MB per process. Entries expire after `ttl` seconds and the least recently
+    used entry is evicted once `capacity` is reached. A hit also needs the same
+    corpus version and the same semantic_guard() as the cached query.
+    """
+
+    def __init__(self, threshold: float = 0.92, capacity: int = 1000, ttl: int = 3600):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+        self._matrix = None  # allocated on first insert, once the dimension is known
+        self._queries = [None] * capacity
+        self._answers = [None] * capacity
+        self._expires = np.zeros(capacity, dtype=np.float64)
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._versions = np.full(capacity, None, dtype=object)  # corpus version tag per row
+        self._guards = np.full(capacity, None, dtype=object)  # semantic_guard() per row
+        self._index = {}  # normalized query -> row
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def _unit(vector):
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def lookup(self, vector, version: str = None, guard: str = None):
+        """Return (answer, similarity, matched_query); answer is None on a miss.
+        Only entries added under the same corpus `version` and `guard` can match."""
+        with self._lock:
+            if self._matrix is None or not self._index:
+                self.stats["misses"] += 1
+                return None, 0.0, None
+
+            now = time.time()
+            sims = self._matrix @ self._unit(vector)
+            sims[self._expires <= now] = -1.0  # expired or empty rows never match
+            sims[self._versions != version] = -1.0  # answered from an older corpus
+            sims[self._guards != guard] = -1.0  # other company / year / numbers
+
+            row = int(np.argmax(sims))
+            similarity = float(sims[row])
+
+            if similarity < self.threshold:
+                self.stats["misses"] += 1
+                return None, similarity, None
+
+            self._last_used[row] = now
+            self.stats["hits"] += 1
+            return self._answers[row], similarity, self._queries[row]
+
+    def add(self, query: str, vector, answer: str, version: str = None, guard: str = None):
+        key = normalize_query(query)
+        unit = self._unit(vector)
+        now = time.time()
+
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.capacity, unit.shape[0]), dtype=np.float32)
+
+            row = self._index.get(key)
+            if row is None:
+                row = self._free_row(now)
+                old_key = self._queries[row]
+                if old_key is not None:
+                    self._index.pop(old_key, None)
+                self._index[key] = row
+
+            self._matrix[row] = unit
+            self._queries[row] = key
+            self._answers[row] = answer
+            self._versions[row] = version
+            self._guards[row] = guard
+            self._expires[row] = now + self.ttl
+            self._last_used[row] = now
+
+    def _free_row(self, now: float) -> int:
+        # expired (or never used) rows first, otherwise the least recently used one
+        expired = np.flatnonzero(self._expires <= now)
+        if expired.size:
+            return int(expired[0])
+        return int(np.argmin(self._last_used))
+
+    def hit_rate(self) -> float:
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+
+
+# ---------------- RERANK SCORE CACHE ----------------
+
+class RerankScoreCache:
+    """
+    Cross-encoder scores keyed by (normalized query, chunk id).
+    In-process LRU in front of an optional Redis tier, where each query is one
+    hash (field = chunk id, value = score) so a whole candidate list is a single HMGET.
+    `model` identifies what produced the scores (rerankers.reranker_id(): model,
+    backend and ONNX file) and is part of every Redis key.
+    """
+
+    def __init__(self, model: str, redis_client=None, max_entries: int = 50000, ttl: int = 7 * 86400, async_redis_client=None):
+        self.model = model
+        self.redis = redis_client
+        self.async_redis = async_redis_client
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def _redis_key(self, normalized: str) -> str:
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        return f"rag:rerank:{self.model}:{digest}"
+
+    def _local_get_many(self, normalized: str, chunk_ids):
+        found = {}
+        with self._lock:
+            for chunk_id in chunk_ids:
+                score = self._lru.get((normalized, chunk_id))
+                if score is not None:
+                    self._lru.move_to_end((normalized, chunk_id))
+                    found[chunk_id] = score
+        return found
+
+    def _remember(self, normalized: str, scores: dict):
+        with self._lock:
+            for chunk_id, score in scores.items():
+                self._lru[(normalized, chunk_id)] = score
+                self._lru.move_to_end((normalized, chunk_id))
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def _count(self, found: dict, total: int):
+        with self._lock:
+            self.stats["hits"] += len(found)
+            self.stats["misses"] += total - len(found)
+
+    def get_many(self, query: str, chunk_ids) -> dict:
+        """Return {chunk_id: score} for every id with a cached score."""
+        normalized = normalize_query(query)
+        found = self._local_get_many(normalized, chunk_ids)
+
+        missing = [c for c in chunk_ids if c not in found]
+        if missing and self.redis is not None:
+            values = self.redis.hmget(self._redis_key(normalized), missing)
+            remote = {c: float(v) for c, v in zip(missing, values) if v is not None}
+            self._remember(normalized, remote)
+            found.update(remote)
+
+        self._count(found, len(chunk_ids))
+        return found
+
+    def set_many(self, query: str, scores: dict):
+        if not scores:
+            return
+        normalized = normalize_query(query)
+        self._remember(normalized, scores)
+        if self.redis is not None:
+            key = self._redis_key(normalized)
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hset(key, mapping=scores)
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+
+    async def aget_many(self, query: str, chunk_ids) -> dict:
+        normalized = normalize_query(query)
+        found = self._local_get_many(normalized, chunk_ids)
+
+        missing = [c for c in chunk_ids if c not in found]
+        if missing and self.async_redis is not None:
+            values = await self.async_redis.hmget(self._redis_key(normalized), missing)
+            remote = {c: float(v) for c, v in zip(missing, values) if v is not None}
+            self._remember(normalized, remote)
+            found.update(remote)
+
+        self._count(found, len(chunk_ids))
+        return found
+
+    async def aset_many(self, query: str, scores: dict):
+        if not scores:
+            return
+        normalized = normalize_query(query)
+        self._remember(normalized, scores)
+        if self.async_redis is not None:
+            key = self._redis_key(normalized)
+            pipe = self.async_redis.pipeline(transaction=False)
+            pipe.hset(key, mapping=scores)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    def hit_rate(self) -> float:
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+
+# ---------------- RESULT CACHES (RETRIEVAL / CONTEXT) ----------------
+
+class ResultCache:
+    """
+    Ranked (chunk_id, score) lists for one pipeline stage, stored beneath the
+    answer cache: the fused retrieval candidates, or the reranked context.
+    Keys are the stage namespace + corpus version + applied filters + normalized
+    query (the same text retrieved under other filters is another list); values are
+    zlib-compressed JSON (IDs and scores only, a few hundred bytes), so a hit
+    costs one Redis GET plus a fetch of the chunk texts by ID.
+    Two tiers: an in-process LRU capped at `max_bytes` of compressed values and
+    Redis with the layer's own `ttl`; a copy taken from Redis expires with the Redis key.
+    """
+
+    def __init__(self, namespace: str, redis_client=None, async_redis_client=None, ttl: int = 86400, max_bytes: int = 16 * 1024 * 1024):
+        self.namespace = namespace
+        self.redis = redis_client  # must be a binary (non-decoding) client
+        self.async_redis = async_redis_client  # optional, also binary
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lru = OrderedDict()  # key -> (compressed value, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"local_hits": 0, "redis_hits": 0, "misses": 0}
+
+    def _key(self, query: str, version: str = None, filters: dict = None) -> str:
+        return f"rag:{self.namespace}:{version or 'v0'}:{filter_scope(filters)}:{normalize_query(query)}"
+
+    @staticmethod
+    def pack(hits, **extra) -> bytes:
+        """hits: [(chunk_id, score), ...] best-first; extra: small JSON-able fields stored alongside."""
+        payload = {"hits": [[cid, round(float(score), 6)] for cid, score in hits], **extra}
+        return zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+
+    @staticmethod
+    def unpack(raw: bytes) -> dict:
+        return json.loads(zlib.decompress(raw))
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                self._evict(key)
+                return None
+            self._lru.move_to_end(key)
+            self.stats["local_hits"] += 1
+            return entry[0]
+
+    def _evict(self, key):
+        raw, _ = self._lru.pop(key)
+        self._bytes -= len(raw)
+
+    def _remember(self, key, raw, ttl=None):
+        with self._lock:
+            if key in self._lru:
+                self._evict(key)
+            self._lru[key] = (raw, time.time() + (ttl or self.ttl))
+            self._bytes += len(raw)
+            while self._bytes > self.max_bytes and self._lru:
+                self._evict(next(iter(self._lru)))
+
+    def _count(self, field):
+        with self._lock:
+            self.stats[field] += 1
+
+    def get(self, query: str, version: str = None, filters: dict = None) -> Optional[dict]:
+        """{"hits": [[chunk_id, score], ...], ...extra} or None."""
+        key = self._key(query, version, filters)
+        raw = self._local_get(key)
+        if raw is None and self.redis is not None:
+            # same round trip as a plain GET; the local copy expires with the Redis key
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.get(key)
+            pipe.pttl(key)
+            raw, pttl = pipe.execute()
+            if raw:
+                self._remember(key, raw, pttl / 1000 if pttl > 0 else None)
+                self._count("redis_hits")
+        if not raw:
+            self._count("misses")
+            return None
+        return self.unpack(raw)
+
+    def set(self, query: str, hits, version: str = None, filters: dict = None, **extra):
+        key = self._key(query, version, filters)
+        raw = self.pack(hits, **extra)
+        self._remember(key, raw)
+        if self.redis is not None:
+            self.redis.setex(key, self.ttl, raw)
+
+    async def aget(self, query: str, version: str = None, filters: dict = None) -> Optional[dict]:
+        key = self._key(query, version, filters)
+        raw = self._local_get(key)
+        if raw is None and self.async_redis is not None:
+            async with self.async_redis.pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.pttl(key)
+                raw, pttl = await pipe.execute()
+            if raw:
+                self._remember(key, raw, pttl / 1000 if pttl > 0 else None)
+                self._count("redis_hits")
+        if not raw:
+            self._count("misses")
+            return None
+        return self.unpack(raw)
 
+    async def aset(self, query: str, hits, version: str = None, filters: dict = None, **extra):
+        key = self._key(query, version, filters)
+        raw = self.pack(hits, **extra)
+        self._remember(key, raw)
+        if self.async_redis is not None:
+            await self.async_redis.setex(key, self.ttl, raw)
 
-def cache_set(query: str, answer: str, redis_client, ttl: int = 3600):
-    """Cache a query-answer pair."""
-    key = f"rag:query:{normalize_query(query)}"
-    redis_client.setex(key, ttl, answer)
\ No newline at end of file
+    def hit_rate(self) -> float:
+        hits = self.stats["local_hits"] + self.stats["redis_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
@@ -0,0 +1,110 @@
+"""
+Compact on-disk chunk store that sits next to a FAISS index.
+
+    chunks.jsonl  one JSON record per FAISS row: {"id", "content", "metadata"}
+    offsets.npy   int64 byte offsets, offsets[i]:offsets[i + 1] is row i
+
+Both files are memory-mapped when read, so a process only pages in the chunks
+it actually returns and several workers share the same page cache.
+"""
+import os
+import json
+import mmap
+import numpy as np
+from langchain_core.documents import Document
+
+CHUNKS_FILE = "chunks.jsonl"
+OFFSETS_FILE = "offsets.npy"
+
+
+class ChunkStoreWriter:
+    """
+    Appends records (in FAISS row order) to temp files as they arrive, so the
+    corpus text is never held in memory. commit() renames them into place, so
+    readers never see a half-written store.
+    """
+
+    def __init__(self, save_dir):
+        self.chunks_path = os.path.join(save_dir, CHUNKS_FILE)
+        self.offsets_path = os.path.join(save_dir, OFFSETS_FILE)
+        self._file = open(self.chunks_path + ".tmp", "wb")
+        self._offsets = [0]
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def add(self, cid, content, metadata):
+        line = json.dumps({"id": cid, "content": content, "metadata": metadata}, ensure_ascii=False)
+        self._file.write(line.encode("utf-8") + b"\n")
+        self._offsets.append(self._file.tell())
+
+    def commit(self):
+        self._file.close()
+        with open(self.offsets_path + ".tmp", "wb") as f:
+            np.save(f, np.asarray(self._offsets, dtype=np.int64))
+        os.replace(self.chunks_path + ".tmp", self.chunks_path)
+        os.replace(self.offsets_path + ".tmp", self.offsets_path)
+        return len(self)
+
+    def abort(self):
+        self._file.close()
+        for path in (self.chunks_path + ".tmp", self.offsets_path + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def write_chunk_store(save_dir, records):
+    """records: iterable of (chunk_id, content, metadata) in FAISS row order."""
+    writer = ChunkStoreWriter(save_dir)
+    for cid, content, metadata in records:
+        writer.add(cid, content, metadata)
+    return writer.commit()
+
+
+class ChunkStore:
+    """Read-only, memory-mapped row -> Document lookup."""
+
+    def __init__(self, index_dir):
+        self._file = open(os.path.join(index_dir, CHUNKS_FILE), "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = np.load(os.path.join(index_dir, OFFSETS_FILE), mmap_mode="r")
+        self._rows = None  # chunk id -> row, filled by facets() or on first row_of()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def record(self, row):
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(self._data[start:end])
+
+    def get(self, row, score=None):
+        rec = self.record(row)
+        metadata = dict(rec["metadata"], chunk_id=rec["id"])
+        if score is not None:
+            metadata["score"] = score
+        return Document(page_content=rec["content"], metadata=metadata)
+
+    def row_of(self, chunk_id):
+        """Row of a chunk id, or None if it is not in the store."""
+        if self._rows is None:
+            self._rows = {self.record(row)["id"]: row for row in range(len(self))}
+        return self._rows.get(chunk_id)
+
+    def facets(self, fields):
+        """{field: {value: [rows]}} for metadata fields; one pass over the store (also indexes chunk ids)."""
+        facets = {field: {} for field in fields}
+        rows = {}
+        for row in range(len(self)):
+            rec = self.record(row)
+            rows[rec["id"]] = row
+            metadata = rec["metadata"]
+            for field in fields:
+                value = metadata.get(field)
+                if value is not None:
+                    facets[field].setdefault(value, []).append(row)
+        self._rows = rows
+        return facets
+
+    def close(self):
+        self._data.close()
+        self._file.close()
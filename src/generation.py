@@ -28,3 +28,25 @@ def generate_answer_rag(query, context, generator_llm, GENERATION_PROMPT):
     
     response = generator_llm.invoke(prompt)
     return response.content
+
+
+async def agenerate_answer_rag(query, context, generator_llm, GENERATION_PROMPT):
+    prompt = GENERATION_PROMPT.format(
+        context=context,
+        query=query
+    )
+
+    response = await generator_llm.ainvoke(prompt)
+    return response.content
+
+
+async def astream_answer_rag(query, context, generator_llm, GENERATION_PROMPT):
+    """Yield answer tokens as the model produces them."""
+    prompt = GENERATION_PROMPT.format(
+        context=context,
+        query=query
+    )
+
+    async for chunk in generator_llm.astream(prompt):
+        if chunk.content:
+            yield chunk.content
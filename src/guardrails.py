@@ -1,38 +1,116 @@
+import os
 import re
-
-# ====================== INBOUND CHECK ====================== #
-def inbound_check(query: str):
+import json
+
+# Categories, their terms and what to do on a match live in a JSON policy file,
+# loaded and compiled once at import. Earlier categories win when several match.
+DEFAULT_POLICY_PATH = os.path.join(os.path.dirname(__file__), "guardrail_policy.json")
+
+_PHONE_RE = re.compile(r"\b\d{10}\b")
+_EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z.-]+\.[A-Za-z]{2,}")
+
+
+# ====================== POLICY ENGINE ====================== #
+def _term_pattern(trie):
+    """Regex for a character trie: shared prefixes are matched once, so cost does not grow with the term count."""
+    branches = []
+    for ch, child in sorted(trie.items()):
+        if ch == "":
+            continue
+        if ch == " ":
+            atom = r"\s+"
+        elif ch == "*":
+            atom = r"\w*"  # "jailbreak*" also matches "jailbreaking"
+        else:
+            atom = re.escape(ch)
+        branches.append(atom + _term_pattern(child))
+
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if "" in trie:
+        # a term ends here and longer ones continue
+        pattern = "(?:" + pattern + ")?"
+    return pattern
+
+
+def compile_terms(terms):
+    trie = {}
+    for term in terms:
+        node = trie
+        for ch in " ".join(term.lower().split()):
+            node = node.setdefault(ch, {})
+        node[""] = {}
+    return _term_pattern(trie)
+
+
+class GuardrailEngine:
     """
-    Runs BEFORE sending query to router/LLM.
-    Validates, sanitizes, and blocks harmful or strongly off-topic input.
+    Every policy category compiled into one word-boundary regex over the lowercased text.
+    classify() scans the text once; each category is a named group, and at every
+    word start the alternation tries categories in priority order.
     """
 
-    q = query.lower().strip()
+    def __init__(self, policy):
+        self.categories = policy["categories"]
+        groups = []
+        for i, category in enumerate(self.categories):
+            anchor = r"\A" if category.get("anchor") == "start" else ""
+            groups.append(f"(?P<c{i}>{anchor}{compile_terms(category['terms'])}\\b)")
+        # tried at word starts only; the zero-width lookahead lets matches of different categories overlap
+        self._regex = re.compile(r"\b(?=" + "|".join(groups) + ")")
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_POLICY_PATH):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def classify(self, text: str):
+        """Highest-priority matching category as {"category", "action", "term", "reason", "message"}, or None."""
+        best, term = None, None
+        for m in self._regex.finditer(text.lower().lstrip()):
+            i = int(m.lastgroup[1:])
+            if best is None or i < best:
+                best, term = i, m.group(m.lastgroup)
+                if best == 0:
+                    break
+
+        if best is None:
+            return None
+        category = self.categories[best]
+        return {
+            "category": category["name"],
+            "action": category["action"],
+            "term": term,
+            "reason": f"{category.get('reason', category['name'])}: \"{term}\"",
+            "message": category.get("message"),
+        }
 
-    # 0. Allow greetings
-    if q in greetings() or q.startswith(tuple(greetings())):
-        return {"status": "ok", "cleaned_query": query}
 
-    # 1. Allow follow-up questions
-    if any(key in q for key in followup_keywords()):
-        return {"status": "ok", "cleaned_query": query}
+_engine = GuardrailEngine.from_file(os.getenv("GUARDRAIL_POLICY", DEFAULT_POLICY_PATH))
 
-    # 2. Block harmful categories
-    if detect_harmful_intent(query):
-        return {"status": "blocked", "message": "I can't help with that."}
 
-    # 3. Block jailbreak attempts
-    if detect_jailbreak(query):
-        return {"status": "blocked", "message": "Request denied for safety reasons."}
+# ====================== INBOUND CHECK ====================== #
+def inbound_check(query: str):
+    """
+    Runs BEFORE sending query to router/LLM.
+    Validates, sanitizes, and blocks harmful or strongly off-topic input.
+    """
+    match = _engine.classify(query)
 
-    # 4. Block strong off-topic content
-    if any(key in q for key in off_topic_keywords()):
+    if match is not None and match["action"] == "block":
         return {
             "status": "blocked",
-            "message": "I can only answer questions related to company annual reports and financial information."
+            "message": match["message"],
+            "reason": match["reason"],
+            "category": match["category"],
         }
 
-    # 5. Mask PII (safe to always allow)
+    # greetings and follow-up questions are passed through as typed
+    if match is not None:
+        return {"status": "ok", "cleaned_query": query, "category": match["category"]}
+
+    # Mask PII (safe to always allow)
     cleaned = mask_pii(query)
 
     return {"status": "ok", "cleaned_query": cleaned}
@@ -46,7 +124,8 @@ def outbound_check(response: str):
     """
 
     # prevent revealing system instructions
-    if "system prompt" in response.lower() and "gpt" in response.lower():
+    lowered = response.lower()
+    if "system prompt" in lowered and "gpt" in lowered:
         return "[Output filtered by safety policy]"
 
     # mask any PII generated by mistake
@@ -55,55 +134,53 @@ def outbound_check(response: str):
     return response
 
 
+class OutboundStream:
+    """
+    outbound_check() applied while the answer streams.
+    feed() returns the part of the text that is safe to send: the tail that could
+    still turn into an email / phone number is held back until a whitespace (no
+    PII match spans one) or until it is longer than any match we mask. Once the
+    text so far trips the system-prompt rule nothing more is released.
+    """
+
+    MAX_HOLD = 254  # longest email address; phone numbers are 10 digits
 
-# ====================== UTILITIES ====================== #
-def off_topic_keywords():
-    return [
-        "recipe", "cook", "cooking", "biryani", "chicken", "pizza",
-        "buy", "shopping", "cheapest", "amazon", "flipkart",
-        "travel", "flight", "hotel",
-        "doctor", "medicine", "health",
-        "gym", "workout",
-        "python code", "write code", "script", "bug", "program",
-        "movie", "netflix", "song", "music",
-        "love", "relationship", "dating"
-    ]
-
-def followup_keywords():
-    return [
-        "previous message", "last answer", "repeat", "continue",
-        "explain that", "explain more", "summarize", "what did i ask",
-        "what did you say"
-    ]
-
-def greetings():
-    return ["hi", "hello", "hey", "thanks", "ok"]
-
-def detect_harmful_intent(text: str):
-    harmful_keywords = [
-        "kill myself", "harm", "make a bomb", "hack", "steal",
-        "ddos", "suicide", "drug", "weapon"
-    ]
-    t = text.lower()
-    return any(k in t for k in harmful_keywords)
-
-
-def detect_jailbreak(text: str):
-    jailbreak_triggers = [
-        "ignore previous instructions",
-        "pretend to be",
-        "act as dan",
-        "reveal your system prompt",
-        "bypass",
-        "jailbreak"
-    ]
-    t = text.lower()
-    return any(k in t for k in jailbreak_triggers)
+    def __init__(self):
+        self._lowered = ""
+        self._pending = ""
+        self.filtered = False
 
+    def _tripped(self):
+        return "system prompt" in self._lowered and "gpt" in self._lowered
 
+    def feed(self, token: str) -> str:
+        if self.filtered:
+            return ""
+        self._lowered += token.lower()
+        self._pending += token
+        if self._tripped():
+            self.filtered = True
+            return ""
+
+        cut = max(self._pending.rfind(" "), self._pending.rfind("\n"), self._pending.rfind("\t")) + 1
+        if cut == 0 and len(self._pending) > self.MAX_HOLD:
+            cut = len(self._pending) - self.MAX_HOLD
+        released, self._pending = self._pending[:cut], self._pending[cut:]
+        return mask_pii(released)
+
+    def flush(self) -> str:
+        """The held-back tail, masked; call once the generator is done."""
+        if self.filtered:
+            return ""
+        released, self._pending = self._pending, ""
+        return mask_pii(released)
+
+
+
+# ====================== UTILITIES ====================== #
 def mask_pii(text: str):
     # Mask phone numbers
-    text = re.sub(r"\b\d{10}\b", "[PHONE_REDACTED]", text)
+    text = _PHONE_RE.sub("[PHONE_REDACTED]", text)
     # Mask email addresses
-    text = re.sub(r"[A-Za-z0-9._%+-]+@[A-Za-z.-]+\.[A-Za-z]{2,}", "[EMAIL_REDACTED]", text)
+    text = _EMAIL_RE.sub("[EMAIL_REDACTED]", text)
     return text
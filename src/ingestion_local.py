@@ -1,9 +1,18 @@
 import os
-from langchain_community.document_loaders import PyMuPDFLoader
+import hashlib
+import itertools
+from collections import deque
+import fitz  # PyMuPDF
+from concurrent.futures import ProcessPoolExecutor
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
+import faiss
+import numpy as np
 from dotenv import load_dotenv
+from src.chunk_store import ChunkStoreWriter, ChunkStore
+from src.bm25_index import build_bm25_index
+from src.caching import load_redis_client, bump_corpus_version
 
 load_dotenv()
 
@@ -20,35 +29,77 @@ def parse_metadata_from_filename(filename):
     return company, year, doctype
 
 
-def load_all_pdfs(folder="../knowledge_base"):
-    all_docs = []
+def _extract_page_range(pdf_path, start, end):
+    """Worker: text of pages [start, end) of one PDF."""
+    with fitz.open(pdf_path) as pdf:
+        return [(i, pdf[i].get_text()) for i in range(start, end)]
 
-    for file in os.listdir(folder):
+
+def _page_range_tasks(folder, pages_per_task):
+    tasks = []
+    for file in sorted(os.listdir(folder)):
         if file.endswith(".pdf"):
             pdf_path = os.path.join(folder, file)
-            print("Loading:", pdf_path)
+            with fitz.open(pdf_path) as pdf:
+                page_count = pdf.page_count
+            for start in range(0, page_count, pages_per_task):
+                tasks.append((file, pdf_path, start, min(start + pages_per_task, page_count)))
+    return tasks
+
+
+def iter_pdf_pages(folder="../knowledge_base", workers=None, pages_per_task=16):
+    """
+    Stream every PDF in `folder` as one Document per page, in (file name, page) order.
+    Page ranges are extracted on a process pool, but at most 2 x workers ranges
+    are in flight or waiting to be consumed, so memory stays bounded no matter
+    how large the corpus is.
+    """
+    workers = workers or int(os.getenv("EXTRACT_WORKERS", "0")) or os.cpu_count() or 1
+    tasks = _page_range_tasks(folder, pages_per_task)
+    print(f"Loading {len({t[0] for t in tasks})} PDFs as {len(tasks)} page ranges on {workers} workers")
+
+    def _to_docs(file, pages):
+        # Extract structured metadata from filename
+        company, year, doctype = parse_metadata_from_filename(file)
+        for page_number, text in pages:
+            yield Document(
+                page_content=text,
+                metadata={
+                    "source": file,
+                    "company": company,
+                    "year": year,
+                    "doctype": doctype,
+                    "page": page_number,
+                },
+            )
 
-            # Extract structured metadata from filename
-            company, year, doctype = parse_metadata_from_filename(file)
+    if workers == 1:
+        for file, path, start, end in tasks:
+            yield from _to_docs(file, _extract_page_range(path, start, end))
+        return
 
-            # Load PDF pages as documents
-            loader = PyMuPDFLoader(pdf_path)
-            docs = loader.load()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        task_iter = iter(tasks)
 
-            for d in docs:
-                # ❗ ERASE ANY EXISTING METADATA
-                d.metadata = {}
+        for file, path, start, end in itertools.islice(task_iter, 2 * workers):
+            pending.append((file, pool.submit(_extract_page_range, path, start, end)))
 
-                # Inject your clean, structured metadata
-                d.metadata["source"] = file
-                d.metadata["company"] = company
-                d.metadata["year"] = year
-                d.metadata["doctype"] = doctype
-                d.metadata["page"] = d.metadata.get("page", None)   # preserve original page if needed
+        while pending:
+            file, future = pending.popleft()
+            pages = future.result()
+            for file_next, path, start, end in itertools.islice(task_iter, 1):
+                pending.append((file_next, pool.submit(_extract_page_range, path, start, end)))
+            yield from _to_docs(file, pages)
 
-            all_docs.extend(docs)
 
-    return all_docs
+def load_all_pdfs(folder="../knowledge_base", workers=None, pages_per_task=16):
+    """
+    Load every PDF in `folder` as one Document per page.
+    Files are split into page ranges and extracted on a process pool; results
+    come back in (file name, page) order regardless of worker count.
+    """
+    return list(iter_pdf_pages(folder, workers, pages_per_task))
 
 
 def get_text_splitter():
@@ -58,8 +109,27 @@ def get_text_splitter():
     )
 
 
-def chunk_docs(docs, splitter):
-    return splitter.split_documents(docs)
+def chunk_id(source, content):
+    """Deterministic chunk ID (same scheme as the Lambda handler): source + content hash."""
+    return f"{source}:{hashlib.sha1(content.encode('utf-8')).hexdigest()}"
+
+
+def iter_chunks(pages, splitter, seen_ids):
+    """Split pages one at a time; yield chunks with chunk_id, skipping IDs already in `seen_ids`."""
+    for page in pages:
+        for chunk in splitter.split_documents([page]):
+            cid = chunk_id(chunk.metadata["source"], chunk.page_content)
+            if cid in seen_ids:
+                continue
+            seen_ids.add(cid)
+            chunk.metadata["chunk_id"] = cid
+            yield chunk
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
 
 
 def get_embedding_model():
@@ -69,22 +139,144 @@ def get_embedding_model():
     )
 
 
-def build_faiss(chunks, embedding, save_dir="faiss_index"):
-    vectorstore = FAISS.from_documents(
-        documents=chunks,
-        embedding=embedding
-    )
-    vectorstore.save_local(save_dir)
-    print("FAISS index saved at:", save_dir)
-    return vectorstore
+def publish_corpus_change(companies):
+    """
+    Bump the corpus version in Redis so cached answers built on the old documents
+    stop being served (see CorpusVersions in src/caching.py). Without
+    ELASTICACHE_ENDPOINT this is skipped and cached answers only expire by TTL;
+    with it, a failed bump raises and fails the ingestion.
+    """
+    if not os.getenv("ELASTICACHE_ENDPOINT"):
+        print("ELASTICACHE_ENDPOINT not set, corpus version not bumped")
+        return None
+    try:
+        version = bump_corpus_version(load_redis_client(), companies)
+    except Exception as e:
+        # the index is saved but cached answers still point at the old documents
+        print(f"❌ Corpus version bump failed, re-run the ingestion: {e}")
+        raise
+    print(f"Corpus version bumped to {version} ({', '.join(sorted(companies)) or 'no companies'})")
+    return version
 
 
+def _read_index(save_dir):
+    """Existing (FAISS index, ChunkStore), or (None, None) before the first ingestion."""
+    index_path = os.path.join(save_dir, "index.faiss")
+    if not os.path.exists(index_path):
+        return None, None
+    mmap_ifc = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+    try:
+        index = faiss.read_index(index_path, mmap_ifc) if mmap_ifc is not None else faiss.read_index(index_path)
+    except RuntimeError:
+        index = faiss.read_index(index_path)
+    return index, ChunkStore(save_dir)
 
-if __name__ == "__main__":
 
-    docs = load_all_pdfs("../knowledge_base")
-    splitter = get_text_splitter()
-    chunks = chunk_docs(docs, splitter)
+def _existing_chunks(chunk_store, sources):
+    """{chunk_id: company} of the stored chunks that came from `sources` (ids only, no text)."""
+    existing = {}
+    for row in range(len(chunk_store) if chunk_store is not None else 0):
+        record = chunk_store.record(row)
+        if record["metadata"].get("source") in sources:
+            existing[record["id"]] = record["metadata"].get("company")
+    return existing
+
+
+def _copy_kept_rows(old_index, old_store, stale_ids, index, writer, batch_size=1024):
+    """Append every old row that is not stale (vector + record) to the new index and chunk store."""
+    for start in range(0, old_index.ntotal, batch_size):
+        end = min(start + batch_size, old_index.ntotal)
+        vectors = old_index.reconstruct_n(start, end - start)
+        keep = []
+        for offset, row in enumerate(range(start, end)):
+            record = old_store.record(row)
+            if record["id"] in stale_ids:
+                continue
+            keep.append(offset)
+            writer.add(record["id"], record["content"], record["metadata"])
+        if keep:
+            index.add(vectors[keep])
+
+
+def ingest_folder(folder="../knowledge_base", embedding=None, save_dir="faiss_index", batch_size=256, workers=None):
+    """
+    Streaming, incremental ingestion of a folder into the local indexes:
+    pages -> splitter -> new chunks only -> fixed-size embedding batches -> index.
+    Chunk text goes straight to the on-disk chunk store as each batch is embedded,
+    so text never accumulates in memory; what does grow with the corpus is the
+    flat FAISS index (rows x 3072 x 4 bytes) and the set of chunk ids. Unchanged
+    chunks are copied over from the previous index, stale ones dropped.
+    Returns {"added", "unchanged", "removed"}.
+    """
+    embedding = embedding or get_embedding_model()
+    os.makedirs(save_dir, exist_ok=True)
+    old_index, old_store = _read_index(save_dir)
+
+    sources = {f for f in os.listdir(folder) if f.endswith(".pdf")}
+    existing = _existing_chunks(old_store, sources)
+    current_ids = set()
+    changed = set()  # companies whose chunks were added or removed
+
+    index = None
+    writer = ChunkStoreWriter(save_dir)
+    try:
+        pages = iter_pdf_pages(folder, workers)
+        chunks = (c for c in iter_chunks(pages, get_text_splitter(), current_ids) if c.metadata["chunk_id"] not in existing)
+
+        added = 0
+        for batch in batched(chunks, batch_size):
+            vectors = np.asarray(embedding.embed_documents([c.page_content for c in batch]), dtype=np.float32)
+            if index is None:
+                index = faiss.IndexFlatL2(vectors.shape[1])
+            index.add(vectors)
+            for c in batch:
+                writer.add(c.metadata["chunk_id"], c.page_content, c.metadata)
+                changed.add(c.metadata["company"])
+            added += len(batch)
+            print(f"Indexed {added} chunks")
+
+        stale_ids = set(existing) - current_ids
+        changed |= {existing[cid] for cid in stale_ids} - {None}
+        stats = {"added": added, "unchanged": len(current_ids & set(existing)), "removed": len(stale_ids)}
+
+        if not added and not stale_ids:
+            writer.abort()
+            print("Nothing changed:", stats)
+            return stats
+
+        if old_index is not None:
+            if index is None:
+                index = faiss.IndexFlatL2(old_index.d)
+            _copy_kept_rows(old_index, old_store, stale_ids, index, writer)
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        if old_store is not None:
+            old_store.close()
+
+    # the serving process may have index.faiss memory-mapped; replace it, don't overwrite it
+    index_path = os.path.join(save_dir, "index.faiss")
+    faiss.write_index(index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+    writer.commit()
+    chunk_store = ChunkStore(save_dir)
+    try:
+        build_bm25_index(chunk_store, save_dir)
+    finally:
+        chunk_store.close()
+    print(f"Indexes saved at: {save_dir} ({index.ntotal} chunks)", stats)
+
+    publish_corpus_change(changed)
+    return stats
+
+
+if __name__ == "__main__":
+    # run from the repo root: python -m src.ingestion_local
     embedding = get_embedding_model()
-    vectorstore = build_faiss(chunks, embedding, "../faiss_index")
-    print("Ingestion complete. Chunks:", len(chunks))
\ No newline at end of file
+    stats = ingest_folder(
+        os.getenv("KNOWLEDGE_BASE_DIR", "knowledge_base"),
+        embedding,
+        os.getenv("FAISS_INDEX_DIR", "faiss_index"),
+    )
+    print("Ingestion complete.", stats)
\ No newline at end of file
@@ -0,0 +1,218 @@
+"""
+On-box "rag" / "direct" router.
+
+A logistic-regression classifier over hashed word, word-bigram and character
+trigram features, trained from the labelled examples in router_model/examples.jsonl.
+Prediction is pure Python with no model downloads and no network call, so it costs
+microseconds; queries it is unsure about are handed to the LLM router (see
+src/router.local_route and main._local_route).
+
+A fixed ~20% of the examples (chosen by a hash of the query text, so it stays
+put as examples are added) is held out of training and calibration. Since the
+examples share phrasings, router_model/eval_queries.jsonl holds queries written
+independently of them (vague, lowercase, no company name); that is the number
+to watch. The calibrated threshold never goes below MIN_THRESHOLD: a wrong
+"direct" answers a corpus question without retrieval.
+
+Train / calibrate on the training split (writes router_model/local_router.json):
+    python -m src.local_router train
+Evaluate on the out-of-template queries and the held-out split, or on a labelled
+query log (JSONL of {"query", "label"}):
+    python -m src.local_router eval
+    python -m src.local_router eval path/to/query_log.jsonl
+"""
+import os
+import re
+import json
+import math
+import random
+import zlib
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), "router_model")
+DEFAULT_EXAMPLES_PATH = os.path.join(MODEL_DIR, "examples.jsonl")
+DEFAULT_MODEL_PATH = os.path.join(MODEL_DIR, "local_router.json")
+OUT_OF_TEMPLATE_PATH = os.path.join(MODEL_DIR, "eval_queries.jsonl")
+MIN_THRESHOLD = 0.85
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_YEAR_RE = re.compile(r"^(19|20)\d\d$")
+
+
+def featurize(query: str, dim: int):
+    """Sparse hashed feature counts {index: value}; crc32 keeps indices stable across processes."""
+    tokens = _TOKEN_RE.findall(query.lower())
+    tokens = ["<year>" if _YEAR_RE.match(t) else t for t in tokens]
+
+    names = [f"w:{t}" for t in tokens]
+    names += [f"b:{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+    for t in tokens:
+        padded = f"^{t}$"
+        names += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    names.append(f"n:{min(len(tokens), 8)}")
+
+    features = {}
+    for name in names:
+        idx = zlib.crc32(name.encode("utf-8")) % dim
+        features[idx] = features.get(idx, 0.0) + 1.0
+
+    # L2-normalize so long and short queries live on the same scale
+    norm = math.sqrt(sum(v * v for v in features.values())) or 1.0
+    return {i: v / norm for i, v in features.items()}
+
+
+def _sigmoid(z: float) -> float:
+    if z >= 0:
+        return 1.0 / (1.0 + math.exp(-z))
+    e = math.exp(z)
+    return e / (1.0 + e)
+
+
+class LocalRouter:
+    """P(rag | query) from a sparse linear model; confidence = max(p, 1 - p)."""
+
+    def __init__(self, weights=None, bias: float = 0.0, dim: int = 2 ** 18, threshold: float = 0.8):
+        self.weights = weights or {}
+        self.bias = bias
+        self.dim = dim
+        self.threshold = threshold
+
+    def predict_proba(self, query: str) -> float:
+        z = self.bias
+        for i, v in featurize(query, self.dim).items():
+            z += self.weights.get(i, 0.0) * v
+        return _sigmoid(z)
+
+    def predict(self, query: str):
+        """Return (decision, confidence)."""
+        p = self.predict_proba(query)
+        return ("rag", p) if p >= 0.5 else ("direct", 1.0 - p)
+
+    def fit(self, examples, epochs: int = 60, lr: float = 0.5, l2: float = 1e-4, seed: int = 0):
+        data = [(featurize(e["query"], self.dim), 1.0 if e["label"] == "rag" else 0.0) for e in examples]
+        rng = random.Random(seed)
+
+        for _ in range(epochs):
+            rng.shuffle(data)
+            for x, y in data:
+                z = self.bias + sum(self.weights.get(i, 0.0) * v for i, v in x.items())
+                grad = _sigmoid(z) - y
+                for i, v in x.items():
+                    w = self.weights.get(i, 0.0)
+                    self.weights[i] = w - lr * (grad * v + l2 * w)
+                self.bias -= lr * grad
+        return self
+
+    def save(self, path: str = DEFAULT_MODEL_PATH):
+        with open(path, "w") as f:
+            json.dump({
+                "dim": self.dim,
+                "bias": round(self.bias, 6),
+                "threshold": self.threshold,
+                "weights": {str(i): round(w, 6) for i, w in self.weights.items() if abs(w) > 1e-6},
+            }, f)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_MODEL_PATH):
+        with open(path) as f:
+            data = json.load(f)
+        weights = {int(i): w for i, w in data["weights"].items()}
+        return cls(weights=weights, bias=data["bias"], dim=data["dim"], threshold=data["threshold"])
+
+
+def load_examples(path: str = DEFAULT_EXAMPLES_PATH):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def split_examples(examples, holdout: float = 0.2):
+    """(train, held_out); membership depends only on the query text."""
+    train, held_out = [], []
+    for e in examples:
+        bucket = zlib.crc32(e["query"].lower().encode("utf-8")) % 1000
+        (held_out if bucket < holdout * 1000 else train).append(e)
+    return train, held_out
+
+
+def evaluation_sets(path: str = None):
+    """[(examples, description), ...] to report on: a query log if given, else out-of-template then held-out."""
+    if path:
+        return [(load_examples(path), f"query log {path}")]
+    _, held_out = split_examples(load_examples())
+    return [
+        (load_examples(OUT_OF_TEMPLATE_PATH), f"out-of-template queries {OUT_OF_TEMPLATE_PATH}"),
+        (held_out, f"held-out split of {DEFAULT_EXAMPLES_PATH} (not used for training)"),
+    ]
+
+
+def evaluation_set(path: str = None):
+    """The first of evaluation_sets(): the query log, or the out-of-template queries."""
+    return evaluation_sets(path)[0]
+
+
+def evaluate(router, examples):
+    """{"n", "confident", "accuracy", "accuracy_on_confident"} of the saved model on `examples`."""
+    predictions = [(router.predict(e["query"]), e["label"]) for e in examples]
+    confident = [(d, label) for (d, c), label in predictions if c >= router.threshold]
+    return {
+        "n": len(examples),
+        "confident": len(confident),
+        "accuracy": sum(d == label for (d, _), label in predictions) / max(len(examples), 1),
+        "accuracy_on_confident": sum(d == label for d, label in confident) / max(len(confident), 1),
+    }
+
+
+def calibrate_threshold(examples, folds: int = 5, target_accuracy: float = 0.98, seed: int = 0):
+    """
+    Cross-validated threshold: the lowest confidence at which the local router's
+    decisions are at least `target_accuracy` correct, but never below MIN_THRESHOLD.
+    Anything below it goes to the LLM.
+    """
+    shuffled = list(examples)
+    random.Random(seed).shuffle(shuffled)
+
+    scored = []  # (confidence, correct)
+    for k in range(folds):
+        train = [e for i, e in enumerate(shuffled) if i % folds != k]
+        held_out = [e for i, e in enumerate(shuffled) if i % folds == k]
+        model = LocalRouter().fit(train)
+        for e in held_out:
+            decision, confidence = model.predict(e["query"])
+            scored.append((confidence, decision == e["label"]))
+
+    scored.sort(reverse=True)
+    threshold = 1.0
+    correct = 0
+    for n, (confidence, ok) in enumerate(scored, start=1):
+        correct += ok
+        if correct / n >= target_accuracy:
+            threshold = confidence
+    return max(threshold, MIN_THRESHOLD)
+
+
+def train_local_router(examples_path: str = DEFAULT_EXAMPLES_PATH, model_path: str = DEFAULT_MODEL_PATH):
+    examples, held_out = split_examples(load_examples(examples_path))
+    threshold = calibrate_threshold(examples)
+    model = LocalRouter(threshold=threshold).fit(examples)
+    model.save(model_path)
+    print(f"Local router trained on {len(examples)} examples ({len(held_out)} held out), threshold={threshold:.3f}")
+    print("Saved:", model_path)
+    return model
+
+
+def load_local_router(model_path: str = DEFAULT_MODEL_PATH):
+    return LocalRouter.load(model_path)
+
+
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "train"
+    if command == "train":
+        train_local_router()
+    else:
+        router = load_local_router()
+        print(f"threshold: {router.threshold:.3f}")
+        for examples, source in evaluation_sets(sys.argv[2] if len(sys.argv) > 2 else None):
+            report = evaluate(router, examples)
+            print(f"evaluated on: {source}")
+            print(f"  accuracy: {report['accuracy']:.3f}  settled locally: {report['confident']}/{report['n']}  accuracy when settled locally: {report['accuracy_on_confident']:.3f}")
@@ -1,72 +1,211 @@
 from langchain_openai import ChatOpenAI
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from redis.exceptions import WatchError
+from src.prompts import MEMORY_SUMMARY_PROMPT
 import os
 import json
+import zlib
+import threading
 
 load_dotenv()
 
+# Redis keeps only the last MEMORY_WINDOW messages per session (LTRIM on every write);
+# of those, the newest that fit in MEMORY_TOKEN_BUDGET are sent to the model.
+MEMORY_WINDOW = int(os.getenv("MEMORY_WINDOW", "20"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "2000"))
+MEMORY_TTL = int(os.getenv("MEMORY_TTL", "86400"))
+
+# Rolling summaries are written off the request path. Folds of one session run one
+# at a time (striped locks in-process, WATCH on the summary key across processes),
+# so two folds never read the same previous summary and drop each other's messages.
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-summary")
+_summary_locks = [threading.Lock() for _ in range(64)]
+SUMMARY_WATCH_RETRIES = 3
+
 
 # ---------------- REDIS-BACKED CHAT HISTORY ----------------
 
+def serialize_message(message: BaseMessage) -> str:
+    """JSON payload stored per list entry in Redis."""
+    if isinstance(message, HumanMessage):
+        msg_type = "human"
+    elif isinstance(message, AIMessage):
+        msg_type = "ai"
+    else:
+        msg_type = "generic"
+
+    return json.dumps({
+        "type": msg_type,
+        "content": message.content
+    })
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text, plus per-message overhead
+    return len(text) // 4 + 4
+
+
+def _decode_window(raw_messages, token_budget):
+    """Newest-first walk over the stored window, keeping what fits in the budget."""
+    messages = []
+    used = 0
+
+    for raw in reversed(raw_messages):
+        data = json.loads(raw)
+        used += estimate_tokens(data["content"])
+        if used > token_budget and messages:
+            break
+        if data["type"] == "human":
+            messages.append(HumanMessage(content=data["content"]))
+        elif data["type"] == "ai":
+            messages.append(AIMessage(content=data["content"]))
+
+    messages.reverse()
+    # a cut (budget or LTRIM) can fall between a question and its answer; an answer
+    # without its question confuses the model, so the history starts on a human turn
+    while messages and isinstance(messages[0], AIMessage):
+        messages.pop(0)
+    return messages
+
+
 class RedisChatMessageHistory(BaseChatMessageHistory):
-    """Chat message history stored in Redis."""
+    """
+    Chat message history stored in Redis as an LTRIM-bounded list.
+    Reads fetch only the last `window` messages; writes append, trim and refresh
+    the TTL in one pipelined round trip. With a summary LLM configured, messages
+    trimmed out of the window are folded into a rolling summary that is
+    prepended as a system message. With a near cache configured, reads are
+    served from process memory and writes update it in the same round trip.
+    """
     
-    def __init__(self, session_id: str, redis_client, ttl: int = 86400):
+    def __init__(self, session_id: str, redis_client, ttl: int = MEMORY_TTL, window: int = MEMORY_WINDOW, token_budget: int = MEMORY_TOKEN_BUDGET):
         self.session_id = session_id
         self.redis = redis_client
         self.ttl = ttl
-        self.key = f"session:{session_id}:messages"
+        self.window = window
+        self.token_budget = token_budget
+        # one hash tag per session: the write MULTI touches both keys, which must share
+        # a slot on cluster-mode Redis (ElastiCache Serverless) or it fails with CROSSSLOT
+        self.key = f"session:{{{session_id}}}:messages"
+        self.summary_key = f"session:{{{session_id}}}:summary"
     
     @property
     def messages(self):
-        """Retrieve messages from Redis."""
-        raw_messages = self.redis.lrange(self.key, 0, -1)
-        messages = []
-        
-        for raw in raw_messages:
-            data = json.loads(raw)
-            if data["type"] == "human":
-                messages.append(HumanMessage(content=data["content"]))
-            elif data["type"] == "ai":
-                messages.append(AIMessage(content=data["content"]))
-        
+        """Retrieve the windowed, token-budgeted messages (plus the summary, if any) from Redis."""
+        cached = _near_cache.get(self.key) if _near_cache is not None else None
+        if cached is not None:
+            raw_window, summary = cached
+        else:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.lrange(self.key, -self.window, -1)
+            if _summary_llm is not None:
+                pipe.get(self.summary_key)
+            results = pipe.execute()
+            raw_window, summary = results[0], results[1] if _summary_llm is not None else None
+            if _near_cache is not None:
+                _near_cache.set(self.key, (raw_window, summary), self.ttl)
+
+        messages = _decode_window(raw_window, self.token_budget)
+        if summary:
+            messages.insert(0, SystemMessage(content=f"Summary of the earlier conversation: {summary}"))
         return messages
     
     def add_message(self, message: BaseMessage):
         """Add a message to Redis."""
-        if isinstance(message, HumanMessage):
-            msg_type = "human"
-        elif isinstance(message, AIMessage):
-            msg_type = "ai"
-        else:
-            msg_type = "generic"
-        
-        data = {
-            "type": msg_type,
-            "content": message.content
-        }
-        
-        self.redis.rpush(self.key, json.dumps(data))
-        self.redis.expire(self.key, self.ttl)
+        self.add_messages([message])
+
+    def queue_write(self, pipe, messages):
+        """Queue append + trim + TTL refresh (and the near-cache read-back / invalidation) on a transaction."""
+        pipe.rpush(self.key, *[serialize_message(m) for m in messages])
+        if _summary_llm is not None:
+            # whatever falls out of the window in this write, read atomically before the trim
+            pipe.lrange(self.key, 0, -(self.window + 1))
+        pipe.ltrim(self.key, -self.window, -1)
+        pipe.expire(self.key, self.ttl)
+        if _near_cache is not None:
+            # the new window for the local copy, and a note to the other processes to drop theirs
+            pipe.lrange(self.key, -self.window, -1)
+            pipe.get(self.summary_key)
+            pipe.publish(_near_cache.channel, _near_cache.message(self.key))
+
+    def after_write(self, results):
+        if _near_cache is not None:
+            _near_cache.set(self.key, (results[-3], results[-2] if _summary_llm is not None else None), self.ttl)
+        if _summary_llm is not None and results[1]:
+            _summary_executor.submit(_fold_into_summary, self.session_id, results[1])
+
+    def add_messages(self, messages):
+        """Append, trim to the window and refresh the TTL in one round trip."""
+        pipe = self.redis.pipeline(transaction=True)
+        self.queue_write(pipe, messages)
+        self.after_write(pipe.execute())
     
     def clear(self):
         """Clear all messages for this session."""
-        self.redis.delete(self.key)
+        self.redis.delete(self.key, self.summary_key)
+        _invalidate_near(self.key)
+
+
+def _invalidate_near(key: str):
+    """Drop a history key from this process's near cache and tell the others."""
+    if _near_cache is None:
+        return
+    _near_cache.invalidate(key)
+    _redis_client.publish(_near_cache.channel, _near_cache.message(key))
+
+
+def _fold_into_summary(session_id: str, evicted_raw):
+    """Merge messages trimmed out of the window into the session's rolling summary."""
+    try:
+        history = RedisChatMessageHistory(session_id, _redis_client)
+        lines = []
+        for raw in evicted_raw:
+            data = json.loads(raw)
+            lines.append(f"{'User' if data['type'] == 'human' else 'Assistant'}: {data['content']}")
+
+        with _summary_locks[zlib.crc32(session_id.encode("utf-8")) % len(_summary_locks)]:
+            for _ in range(SUMMARY_WATCH_RETRIES):
+                with _redis_client.pipeline(transaction=True) as pipe:
+                    try:
+                        # another process folding this session in the meantime aborts the SET; redo on its summary
+                        pipe.watch(history.summary_key)
+                        previous = pipe.get(history.summary_key) or ""
+                        prompt = MEMORY_SUMMARY_PROMPT.format(summary=previous or "(none)", messages="\n".join(lines))
+                        summary = _summary_llm.invoke(prompt).content.strip()
+                        pipe.multi()
+                        pipe.set(history.summary_key, summary, ex=history.ttl)
+                        pipe.execute()
+                        break
+                    except WatchError:
+                        continue
+            else:
+                print(f"⚠️ Memory summary for session {session_id} kept changing, {len(lines)} messages not folded in")
+                return
+        _invalidate_near(history.key)
+    except Exception as e:
+        print(f"⚠️ Memory summary update failed for session {session_id}: {e}")
 
 
 # ---------------- MEMORY STORE ----------------
 
 _redis_client = None  # Will be set by initialize_redis()
+_async_redis_client = None  # Optional, used by amemory_set()
+_summary_llm = None  # Optional, enables rolling summaries
+_near_cache = None  # Optional NearCache (src/caching.py) for history windows
 
 
-def initialize_redis(redis_client):
-    """Initialize Redis client for session storage."""
-    global _redis_client
+def initialize_redis(redis_client, async_redis_client=None, summary_llm=None, near_cache=None):
+    """Initialize Redis client for session storage (plus, optionally, the summary LLM and a near cache)."""
+    global _redis_client, _async_redis_client, _summary_llm, _near_cache
     _redis_client = redis_client
+    _async_redis_client = async_redis_client
+    _summary_llm = summary_llm
+    _near_cache = near_cache
     # print("✅ Redis initialized for session memory")
 
 
@@ -113,14 +252,58 @@ def generate_answer_chat_memory(query: str, session_id: str, memory_chain=None):
     return result.content
 
 
+def _turn_messages(human: str = None, assistant: str = None):
+    messages = []
+    if human is not None:
+        messages.append(HumanMessage(content=human))
+    if assistant is not None:
+        messages.append(AIMessage(content=assistant))
+    return messages
+
+
 def memory_set(session_id: str, human: str = None, assistant: str = None):
-    """Manually add messages to session history."""
-    history = get_history(session_id)
+    """Manually add a user / assistant turn to session history (one Redis round trip)."""
+    messages = _turn_messages(human, assistant)
+    if messages:
+        get_history(session_id).add_messages(messages)
 
-    if human is not None:
-        history.add_user_message(human)
-        # print(f"💬 [Session {session_id}] Saved User: {human}")
 
-    if assistant is not None:
-        history.add_ai_message(assistant)
-        # print(f"💬 [Session {session_id}] Saved Assistant: {assistant[:100]}...")
\ No newline at end of file
+async def agenerate_answer_chat_memory(query: str, session_id: str, memory_chain=None):
+    """Async variant of generate_answer_chat_memory."""
+    if memory_chain is None:
+        raise ValueError("memory_chain must be provided")
+
+    result = await memory_chain.ainvoke(
+        {"input": query},
+        config={"configurable": {"session_id": session_id}}
+    )
+    return result.content
+
+
+async def astream_answer_chat_memory(query: str, session_id: str, memory_chain=None):
+    """Yield tokens from the memory-enabled chat model as they arrive."""
+    if memory_chain is None:
+        raise ValueError("memory_chain must be provided")
+
+    async for chunk in memory_chain.astream(
+        {"input": query},
+        config={"configurable": {"session_id": session_id}}
+    ):
+        if chunk.content:
+            yield chunk.content
+
+
+async def amemory_set(session_id: str, human: str = None, assistant: str = None):
+    """Async variant of memory_set, writes through the asyncio Redis client."""
+    if _async_redis_client is None:
+        raise RuntimeError("Async Redis not initialized. Pass async_redis_client to initialize_redis().")
+
+    messages = _turn_messages(human, assistant)
+    if not messages:
+        return
+
+    history = RedisChatMessageHistory(session_id, _async_redis_client)
+    async with _async_redis_client.pipeline(transaction=True) as pipe:
+        history.queue_write(pipe, messages)
+        results = await pipe.execute()
+    history.after_write(results)
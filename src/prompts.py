@@ -25,6 +25,18 @@ QUESTION:
 Final Answer:
 """
 
+MEMORY_SUMMARY_PROMPT = """
+Update the running summary of a conversation with the messages that follow it.
+Keep facts, names, numbers and open questions the assistant may need later; drop small talk.
+Reply with the updated summary only, at most 150 words.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+"""
+
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 def get_chat_prompt():
@@ -0,0 +1,65 @@
+"""
+Query understanding: detect companies and years a query is about and turn them
+into metadata filters for both retrieval legs.
+
+Only values that actually exist in the index are recognised. They are read at
+startup, and again after a re-ingest moves the corpus version, with a terms
+aggregation on OpenSearch or from the facets of the local chunk store. "Apple revenue 2023" becomes {"company": ["Apple"], "year": [2023]}.
+A query that names no known company or year gets no filter.
+"""
+import re
+
+FILTER_FIELDS = ("company", "year")
+
+_YEAR_RE = re.compile(r"\b(?:fy\s?)?((?:19|20)\d\d)\b", re.IGNORECASE)
+
+
+def known_values_os(client, index_name, size=1000):
+    """Distinct company / year values in the index via one terms aggregation request."""
+    body = {
+        "size": 0,
+        "aggs": {field: {"terms": {"field": field, "size": size}} for field in FILTER_FIELDS},
+    }
+    response = client.search(index=index_name, body=body, filter_path="aggregations")
+    return {
+        field: [bucket["key"] for bucket in response["aggregations"][field]["buckets"]]
+        for field in FILTER_FIELDS
+    }
+
+
+class QueryFilterExtractor:
+    """Matches known company names (case-insensitive, whole words) and known years in a query."""
+
+    def __init__(self, known_values):
+        self.companies = {}
+        for company in known_values.get("company", []):
+            # "Bank_of_America" / "BankOfAmerica" style file names are matched as spoken
+            for variant in {company, company.replace("_", " "), re.sub(r"(?<=[a-z])(?=[A-Z])", " ", company)}:
+                self.companies[variant.lower()] = company
+        self.years = {int(y) for y in known_values.get("year", [])}
+
+        names = sorted(self.companies, key=len, reverse=True)  # longest first: "meta platforms" before "meta"
+        self._company_re = (
+            re.compile(r"\b(" + "|".join(re.escape(n) for n in names) + r")(?:'s)?\b", re.IGNORECASE)
+            if names else None
+        )
+
+    def extract(self, query):
+        """{"company": [...], "year": [...]} with only the fields that matched."""
+        filters = {}
+
+        if self._company_re is not None:
+            companies = {self.companies[m.lower()] for m in self._company_re.findall(query)}
+            if companies:
+                filters["company"] = sorted(companies)
+
+        years = {int(y) for y in _YEAR_RE.findall(query)} & self.years
+        if years:
+            filters["year"] = sorted(years)
+
+        return filters
+
+
+def filter_clauses(filters):
+    """OpenSearch `terms` clauses for a filters dict (empty list = no filtering)."""
+    return [{"terms": {field: values}} for field, values in (filters or {}).items()]
@@ -1,28 +1,208 @@
-from sentence_transformers import CrossEncoder
+import os
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from langchain_core.documents import Document
+from src.retrieval import chunk_key
+
+RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+# Cross-encoder scoring is CPU-bound; the async pipeline runs it here
+# so the event loop keeps serving other requests meanwhile.
+_rerank_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("RERANK_WORKERS", "2")),
+    thread_name_prefix="rerank",
+)
+
+def _onnx_file(backend):
+    default_file = "onnx/model_qint8_avx512_vnni.onnx" if backend == "onnx-int8" else None
+    return os.getenv("RERANKER_ONNX_FILE") or default_file
+
+
+def reranker_id(backend=None):
+    """Model, backend and ONNX file the scores come from; caches of scores or reranked lists key on it."""
+    backend = backend or os.getenv("RERANKER_BACKEND", "torch")
+    parts = [RERANKER_MODEL, backend]
+    if backend in ("onnx", "onnx-int8"):
+        parts.append(_onnx_file(backend) or "default")
+    return ":".join(parts)
+
 
 # bge reranker
-def load_reranker():
-    return CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
+def load_reranker(backend=None, threads=None):
+    """
+    backend:
+      "torch"     - default fp32 PyTorch model
+      "int8"      - PyTorch dynamic int8 quantization of the Linear layers
+      "onnx"      - ONNX Runtime export
+      "onnx-int8" - ONNX Runtime, int8-quantized export shipped with the model repo
+    threads: intra-op threads for torch / ONNX Runtime (default: library default)
+    RERANKER_ONNX_FILE picks the ONNX file inside the model repo for either ONNX
+    backend, e.g. onnx/model_qint8_arm64.onnx on CPUs without AVX-512 VNNI.
+    """
+    # imported here: sentence_transformers pulls in torch, which alone takes seconds to import
+    from sentence_transformers import CrossEncoder
 
-def rerank_documents(query, reranker, docs, top_k=10):
-    if not docs:
-        return []
+    backend = backend or os.getenv("RERANKER_BACKEND", "torch")
+    threads = threads or int(os.getenv("RERANKER_THREADS", "0")) or None
+
+    if backend in ("onnx", "onnx-int8"):
+        model_kwargs = {}
+        onnx_file = _onnx_file(backend)
+        if onnx_file:
+            model_kwargs["file_name"] = onnx_file
+        if threads:
+            import onnxruntime as ort
+            session_options = ort.SessionOptions()
+            session_options.intra_op_num_threads = threads
+            model_kwargs["session_options"] = session_options
+        return CrossEncoder(RERANKER_MODEL, backend="onnx", model_kwargs=model_kwargs)
+
+    import torch
+    if threads:
+        torch.set_num_threads(threads)
+
+    reranker = CrossEncoder(RERANKER_MODEL)
+    if backend == "int8":
+        reranker.model = torch.quantization.quantize_dynamic(
+            reranker.model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    return reranker
+
+
+class RerankerService:
+    """
+    Micro-batching front for a CrossEncoder.
+    Pairs submitted by concurrent requests are queued and scored together by a
+    single worker thread: a batch is flushed once it holds `max_batch_size` pairs
+    or the oldest request has waited `max_wait_ms`.
+    Exposes predict(pairs) so it can be passed anywhere a CrossEncoder is expected.
+    """
+
+    def __init__(self, model, max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self.stats = {"batches": 0, "pairs": 0, "requests": 0}
+
+        self._worker = threading.Thread(target=self._run, name="reranker-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, pairs) -> Future:
+        """Queue pairs for scoring; the Future resolves to a list of floats."""
+        future = Future()
+        self._queue.put((list(pairs), future))
+        return future
+
+    def predict(self, pairs):
+        return self.submit(pairs).result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        size = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            pairs = [pair for item_pairs, _ in batch for pair in item_pairs]
+
+            try:
+                scores = self.model.predict(pairs, batch_size=self.max_batch_size)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
 
-    # build pairs (query, doc_text)
-    pairs = [(query, d.page_content) for d in docs]
+            self.stats["batches"] += 1
+            self.stats["pairs"] += len(pairs)
+            self.stats["requests"] += len(batch)
 
-    # run cross encoder scoring
-    scores = reranker.predict(pairs)
+            offset = 0
+            for item_pairs, future in batch:
+                future.set_result([float(s) for s in scores[offset:offset + len(item_pairs)]])
+                offset += len(item_pairs)
 
-    # attach scores to docs
-    for doc, score in zip(docs, scores):
-        doc.metadata["rerank_score"] = float(score)
+
+def _rank(docs, scores, top_k):
+    # attach scores to copies, the retrieved docs may be shared with other requests
+    scored = [
+        Document(page_content=doc.page_content, metadata={**doc.metadata, "rerank_score": float(score)})
+        for doc, score in zip(docs, scores)
+    ]
 
     # sort by score (descending)
-    ranked = sorted(docs, key=lambda x: x.metadata["rerank_score"], reverse=True)
+    ranked = sorted(scored, key=lambda x: x.metadata["rerank_score"], reverse=True)
 
     return ranked[:top_k]
 
+
+def _merge_scores(keys, cached, fresh_scores, missing):
+    fresh = {keys[i]: float(s) for i, s in zip(missing, fresh_scores)}
+    return [cached[k] if k in cached else fresh[k] for k in keys], fresh
+
+
+def rerank_documents(query, reranker, docs, top_k=10, score_cache=None):
+    if not docs:
+        return []
+
+    keys = [chunk_key(d) for d in docs]
+    cached = score_cache.get_many(query, keys) if score_cache is not None else {}
+
+    # only pairs without a cached score go to the cross encoder
+    missing = [i for i, k in enumerate(keys) if k not in cached]
+    pairs = [(query, docs[i].page_content) for i in missing]
+    fresh_scores = reranker.predict(pairs) if pairs else []
+
+    scores, fresh = _merge_scores(keys, cached, fresh_scores, missing)
+    if score_cache is not None:
+        score_cache.set_many(query, fresh)
+
+    return _rank(docs, scores, top_k)
+
+
+async def arerank_documents(query, reranker, docs, top_k=10, score_cache=None):
+    if not docs:
+        return []
+
+    keys = [chunk_key(d) for d in docs]
+    cached = await score_cache.aget_many(query, keys) if score_cache is not None else {}
+
+    missing = [i for i, k in enumerate(keys) if k not in cached]
+    pairs = [(query, docs[i].page_content) for i in missing]
+
+    if not pairs:
+        fresh_scores = []
+    elif isinstance(reranker, RerankerService):
+        # the batcher thread does the work; just await its future
+        fresh_scores = await asyncio.wrap_future(reranker.submit(pairs))
+    else:
+        loop = asyncio.get_running_loop()
+        fresh_scores = await loop.run_in_executor(_rerank_executor, reranker.predict, pairs)
+
+    scores, fresh = _merge_scores(keys, cached, fresh_scores, missing)
+    if score_cache is not None:
+        await score_cache.aset_many(query, fresh)
+
+    return _rank(docs, scores, top_k)
+
+
 def show_reranked(docs, top_n=10):
     for i, d in enumerate(docs[:top_n]):
         print(f"--- Rank {i+1} | Score: {d.metadata['rerank_score']:.4f} ---")
@@ -1,13 +1,25 @@
 import os
+import time
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from langchain_openai import OpenAIEmbeddings
 from langchain_core.documents import Document
+from opensearchpy.exceptions import RequestError
 from dotenv import load_dotenv
-import os
+from src.query_filters import FILTER_FIELDS, known_values_os, filter_clauses
 # from aws_infra.opensearch.client import get_opensearch_client
   
 
 load_dotenv()
 
+# Shared pool for running the BM25 and kNN legs side by side.
+# The OpenSearch client keeps a pooled HTTP session, so both legs reuse connections.
+_retrieval_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("RETRIEVAL_WORKERS", "8")),
+    thread_name_prefix="retrieval",
+)
+
 
 def get_embedding_model():
     return OpenAIEmbeddings(
@@ -22,73 +34,154 @@ def get_embedding_model():
 #     return client
 
 
-def semantic_retrieve_os(query, client, embedder, index_name, k=10):
-    query_vector = embedder.embed_query(query)
+# Only what docs_from_response reads; leaving out the 3072-float "embedding"
+# field cuts each hit from tens of KB of JSON to the chunk text plus a few fields.
+SOURCE_FIELDS = ["content", "source", "company", "year", "doctype"]
+
+# response-level trimming: drop took/_shards/max_score/_index etc.
+SEARCH_FILTER_PATH = "hits.hits._id,hits.hits._score,hits.hits._source"
+MGET_FILTER_PATH = "docs._id,docs.found,docs._source"
 
-    response = client.search(
-        index=index_name,
-        body={
-            "size": k,
-            "query": {
-                "knn": {
-                    "embedding": {
-                        "vector": query_vector,
-                        "k": k
-                    }
-                }
+
+def knn_query_body(query_vector, k=10, filters=None):
+    knn = {
+        "vector": query_vector,
+        "k": k
+    }
+    clauses = filter_clauses(filters)
+    if clauses:
+        # efficient (pre-)filtering: the k neighbours are searched among matching chunks only
+        knn["filter"] = {"bool": {"filter": clauses}}
+
+    return {
+        "size": k,
+        "_source": SOURCE_FIELDS,
+        "query": {
+            "knn": {
+                "embedding": knn
             }
         }
-    )
+    }
 
-    docs = []
-    for hit in response["hits"]["hits"]:
-        src = hit["_source"]
-        docs.append(
-            Document(
-                page_content=src["content"],
-                metadata={
-                    "source": src.get("source"),
-                    "company": src.get("company"),
-                    "year": src.get("year"),
-                    "doctype": src.get("doctype"),
-                }
-            )
-        )
-
-    return docs
-
-
-def bm25_retrieve_os(query, client, index_name, k=10):
-    response = client.search(
-        index=index_name,
-        body={
-            "size": k,
-            "query": {
-                "match": {
-                    "content": {
-                        "query": query
-                    }
-                }
+
+# Indexes built with the nmslib engine reject "filter" inside a knn query (only
+# faiss / lucene support it). Those get a post_filter over an oversampled kNN
+# instead, and are remembered so the failing request is sent only once.
+KNN_POST_FILTER_OVERSAMPLE = int(os.getenv("KNN_POST_FILTER_OVERSAMPLE", "5"))
+_knn_filter_unsupported = set()  # index names
+
+
+def knn_post_filter_body(query_vector, k=10, filters=None):
+    body = knn_query_body(query_vector, k * KNN_POST_FILTER_OVERSAMPLE)
+    body["size"] = k
+    body["post_filter"] = {"bool": {"filter": filter_clauses(filters)}}
+    return body
+
+
+def bm25_query_body(query, k=10, filters=None):
+    match = {
+        "match": {
+            "content": {
+                "query": query
             }
         }
+    }
+    clauses = filter_clauses(filters)
+
+    return {
+        "size": k,
+        "_source": SOURCE_FIELDS,
+        "query": {"bool": {"must": match, "filter": clauses}} if clauses else match
+    }
+
+
+def _doc_from_hit(hit):
+    src = hit["_source"]
+    return Document(
+        page_content=src["content"],
+        metadata={
+            "source": src.get("source"),
+            "company": src.get("company"),
+            "year": src.get("year"),
+            "doctype": src.get("doctype"),
+            "chunk_id": hit["_id"],
+            "score": hit.get("_score"),
+        }
     )
 
-    docs = []
-    for hit in response["hits"]["hits"]:
-        src = hit["_source"]
-        docs.append(
-            Document(
-                page_content=src["content"],
-                metadata={
-                    "source": src.get("source"),
-                    "company": src.get("company"),
-                    "year": src.get("year"),
-                    "doctype": src.get("doctype"),
-                }
-            )
-        )
 
-    return docs
+def docs_from_response(response):
+    """
+    Search hits -> Documents, shared by every OpenSearch search.
+    With filter_path an empty result has no "hits" key at all.
+    """
+    return [_doc_from_hit(hit) for hit in response.get("hits", {}).get("hits", ())]
+
+
+def docs_from_mget(response):
+    """mget response -> Documents in request order; ids that no longer exist are skipped."""
+    return [_doc_from_hit(doc) for doc in response.get("docs", ()) if doc.get("found")]
+
+
+def search_os(client, index_name, body):
+    return client.search(index=index_name, body=body, filter_path=SEARCH_FILTER_PATH)
+
+
+async def asearch_os(async_client, index_name, body):
+    return await async_client.search(index=index_name, body=body, filter_path=SEARCH_FILTER_PATH)
+
+
+def semantic_retrieve_os(query, client, embedder, index_name, k=10, filters=None):
+    query_vector = embedder.embed_query(query)
+    return knn_retrieve_os(query_vector, client, index_name, k=k, filters=filters)
+
+
+def knn_retrieve_os(query_vector, client, index_name, k=10, filters=None):
+    if filters and index_name not in _knn_filter_unsupported:
+        try:
+            return docs_from_response(search_os(client, index_name, knn_query_body(query_vector, k, filters)))
+        except RequestError as e:
+            _knn_filter_rejected(index_name, e)
+    if filters:
+        return docs_from_response(search_os(client, index_name, knn_post_filter_body(query_vector, k, filters)))
+    return docs_from_response(search_os(client, index_name, knn_query_body(query_vector, k)))
+
+
+def _knn_filter_rejected(index_name, error):
+    print(f"⚠️ {index_name} rejects kNN filters (nmslib engine?), using post_filter instead: {error}")
+    _knn_filter_unsupported.add(index_name)
+
+
+def bm25_retrieve_os(query, client, index_name, k=10, filters=None):
+    response = search_os(client, index_name, bm25_query_body(query, k, filters))
+    return docs_from_response(response)
+
+
+# ---------------- ASYNC (AsyncOpenSearch) ----------------
+
+async def aknn_retrieve_os(query_vector, async_client, index_name, k=10, filters=None):
+    if filters and index_name not in _knn_filter_unsupported:
+        try:
+            return docs_from_response(await asearch_os(async_client, index_name, knn_query_body(query_vector, k, filters)))
+        except RequestError as e:
+            _knn_filter_rejected(index_name, e)
+    if filters:
+        return docs_from_response(await asearch_os(async_client, index_name, knn_post_filter_body(query_vector, k, filters)))
+    return docs_from_response(await asearch_os(async_client, index_name, knn_query_body(query_vector, k)))
+
+
+async def abm25_retrieve_os(query, async_client, index_name, k=10, filters=None):
+    response = await asearch_os(async_client, index_name, bm25_query_body(query, k, filters))
+    return docs_from_response(response)
+
+
+def chunk_key(doc):
+    """Stable identity for a chunk: the OpenSearch _id if known, else a content hash."""
+    chunk_id = doc.metadata.get("chunk_id")
+    if chunk_id:
+        return chunk_id
+    digest = hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+    return f"{doc.metadata.get('source')}:{digest}"
 
 
 def deduplicate_docs(docs):
@@ -96,10 +189,7 @@ def deduplicate_docs(docs):
     unique = []
 
     for doc in docs:
-        key = (
-            doc.metadata.get("source"),
-            doc.page_content[:50]
-        )
+        key = chunk_key(doc)
         if key not in seen:
             unique.append(doc)
             seen.add(key)
@@ -107,31 +197,331 @@ def deduplicate_docs(docs):
     return unique
 
 
+def fuse_rrf(ranked_lists, k=60, top_n=None):
+    """
+    Reciprocal rank fusion: score(d) = sum over lists of 1 / (k + rank).
+    Rank-based, so BM25 and cosine scores never need to be on the same scale.
+    Duplicates across lists are merged on chunk_key; the fused score is stored
+    in metadata["rrf_score"] and the result is sorted best-first.
+    """
+    fused = {}
+    scores = {}
+
+    for docs in ranked_lists:
+        for rank, doc in enumerate(docs, start=1):
+            key = chunk_key(doc)
+            if key not in fused:
+                fused[key] = doc
+                scores[key] = 0.0
+            scores[key] += 1.0 / (k + rank)
+
+    ranked_keys = sorted(scores, key=scores.get, reverse=True)
+    if top_n is not None:
+        ranked_keys = ranked_keys[:top_n]
+
+    ranked = []
+    for key in ranked_keys:
+        doc = fused[key]
+        doc.metadata["rrf_score"] = scores[key]
+        ranked.append(doc)
+
+    return ranked
+
+
 def retrieve_candidates_os(
     query,
     client,
     embedder,
     index_name,
     k_bm25=10,
-    k_sem=10
+    k_sem=10,
+    top_n=None,
+    filters=None
 ):
     # 1) BM25
-    bm25_docs = bm25_retrieve_os(query, client, index_name, k=k_bm25)
+    bm25_docs = bm25_retrieve_os(query, client, index_name, k=k_bm25, filters=filters)
 
     # 2) Semantic
     semantic_docs = semantic_retrieve_os(
-        query, client, embedder, index_name, k=k_sem
+        query, client, embedder, index_name, k=k_sem, filters=filters
     )
 
-    # 3) Combine
-    combined = bm25_docs + semantic_docs
-
-    # 4) Deduplicate
-    combined = deduplicate_docs(combined)
+    # 3) Fuse (RRF) + deduplicate on chunk id
+    combined = fuse_rrf([bm25_docs, semantic_docs], top_n=top_n)
 
     return len(bm25_docs), len(semantic_docs), len(combined), combined
 
 
+def retrieve_candidates_os_parallel(
+    query,
+    client,
+    embedder,
+    index_name,
+    k_bm25=10,
+    k_sem=10,
+    top_n=None,
+    filters=None
+):
+    """
+    Hybrid retrieval with both legs in flight at once.
+    The BM25 search runs while the query is being embedded, so latency is
+    max(bm25, embed + knn) instead of bm25 + embed + knn.
+    Returns the same tuple as retrieve_candidates_os plus per-leg timings (ms).
+    """
+    timings = {}
+
+    def _bm25_leg():
+        t0 = time.perf_counter()
+        docs = bm25_retrieve_os(query, client, index_name, k=k_bm25, filters=filters)
+        timings["bm25_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        return docs
+
+    def _semantic_leg():
+        t0 = time.perf_counter()
+        query_vector = embedder.embed_query(query)
+        t1 = time.perf_counter()
+        docs = knn_retrieve_os(query_vector, client, index_name, k=k_sem, filters=filters)
+        timings["embed_ms"] = round((t1 - t0) * 1000, 1)
+        timings["knn_ms"] = round((time.perf_counter() - t1) * 1000, 1)
+        return docs
+
+    start = time.perf_counter()
+    bm25_future = _retrieval_executor.submit(_bm25_leg)
+    semantic_future = _retrieval_executor.submit(_semantic_leg)
+
+    bm25_docs = bm25_future.result()
+    semantic_docs = semantic_future.result()
+
+    combined = fuse_rrf([bm25_docs, semantic_docs], top_n=top_n)
+    timings["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+    return len(bm25_docs), len(semantic_docs), len(combined), combined, timings
+
+
+async def aretrieve_candidates_os(
+    query,
+    async_client,
+    embedder,
+    index_name,
+    k_bm25=10,
+    k_sem=10,
+    top_n=None,
+    filters=None
+):
+    """
+    asyncio counterpart of retrieve_candidates_os_parallel.
+    Both legs are awaited together on the event loop, no threads involved.
+    """
+    timings = {}
+
+    async def _bm25_leg():
+        t0 = time.perf_counter()
+        docs = await abm25_retrieve_os(query, async_client, index_name, k=k_bm25, filters=filters)
+        timings["bm25_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        return docs
+
+    async def _semantic_leg():
+        t0 = time.perf_counter()
+        query_vector = await embedder.aembed_query(query)
+        t1 = time.perf_counter()
+        docs = await aknn_retrieve_os(query_vector, async_client, index_name, k=k_sem, filters=filters)
+        timings["embed_ms"] = round((t1 - t0) * 1000, 1)
+        timings["knn_ms"] = round((time.perf_counter() - t1) * 1000, 1)
+        return docs
+
+    start = time.perf_counter()
+    bm25_docs, semantic_docs = await asyncio.gather(_bm25_leg(), _semantic_leg())
+
+    combined = fuse_rrf([bm25_docs, semantic_docs], top_n=top_n)
+    timings["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+    return len(bm25_docs), len(semantic_docs), len(combined), combined, timings
+
+
+# ---------------- Retriever backends ----------------
+# Both expose the same calls; retrieve / aretrieve return
+# (n_bm25, n_semantic, n_combined, docs, timings) like retrieve_candidates_os_parallel:
+#   retrieve(query, k_bm25, k_sem, top_n, filters)
+#   await aretrieve(query, k_bm25, k_sem, top_n, filters)
+#   known_values() -> {"company": [...], "year": [...]} present in the index
+
+class OpenSearchRetriever:
+    """Hybrid BM25 + kNN retrieval against the OpenSearch cluster."""
+
+    name = "opensearch"
+
+    def __init__(self, client, async_client, embedder, index_name, parallel=True):
+        self.client = client
+        self.async_client = async_client
+        self.embedder = embedder
+        self.index_name = index_name
+        self.parallel = parallel
+
+    def known_values(self):
+        return known_values_os(self.client, self.index_name)
+
+    def fetch(self, chunk_ids):
+        """Documents for chunk IDs (result-cache hits), one mget round trip."""
+        response = self.client.mget(index=self.index_name, body={"ids": list(chunk_ids)}, _source=SOURCE_FIELDS, filter_path=MGET_FILTER_PATH)
+        return docs_from_mget(response)
+
+    async def afetch(self, chunk_ids):
+        response = await self.async_client.mget(index=self.index_name, body={"ids": list(chunk_ids)}, _source=SOURCE_FIELDS, filter_path=MGET_FILTER_PATH)
+        return docs_from_mget(response)
+
+    def retrieve(self, query, k_bm25=10, k_sem=10, top_n=None, filters=None):
+        if self.parallel:
+            return retrieve_candidates_os_parallel(query, self.client, self.embedder, self.index_name, k_bm25=k_bm25, k_sem=k_sem, top_n=top_n, filters=filters)
+        result = retrieve_candidates_os(query, self.client, self.embedder, self.index_name, k_bm25=k_bm25, k_sem=k_sem, top_n=top_n, filters=filters)
+        return (*result, {})
+
+    async def aretrieve(self, query, k_bm25=10, k_sem=10, top_n=None, filters=None):
+        return await aretrieve_candidates_os(query, self.async_client, self.embedder, self.index_name, k_bm25=k_bm25, k_sem=k_sem, top_n=top_n, filters=filters)
+
+
+class FaissRetriever:
+    """
+    In-process hybrid retrieval over the indexes written by src/ingestion_local.py:
+    kNN on the FAISS index and BM25 on the array-backed inverted index, fused with RRF.
+    The chunk store and BM25 arrays are memory-mapped. The FAISS vectors are too
+    with faiss >= 1.9 (IO_FLAG_MMAP_IFC maps the flat index codes read-only, so
+    gunicorn workers share one copy through the page cache); older builds read
+    them into each worker's heap (`index_mmapped` is False then).
+    Without a BM25 index on disk only the kNN leg runs (n_bm25 is 0).
+    Metadata filters are applied before scoring on both legs, using row lists
+    per company / year collected from the chunk store at load time.
+    """
+
+    name = "faiss"
+
+    def __init__(self, index_dir, embedder):
+        import faiss
+        import numpy as np
+        from src.chunk_store import ChunkStore
+        from src.bm25_index import BM25Index
+
+        index_path = os.path.join(index_dir, "index.faiss")
+        # IO_FLAG_MMAP alone still copies IndexFlat codes into memory; only
+        # IO_FLAG_MMAP_IFC (faiss >= 1.9) serves them straight from the mapped file
+        mmap_ifc = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+        self.index = None
+        self.index_mmapped = False
+        if mmap_ifc is not None:
+            try:
+                self.index = faiss.read_index(index_path, mmap_ifc)
+                self.index_mmapped = True
+            except RuntimeError:
+                pass  # index type without mmap support
+        if self.index is None:
+            self.index = faiss.read_index(index_path)
+            print("⚠️ FAISS index loaded into memory (needs faiss >= 1.9 and a flat index to memory-map)")
+        self.chunks = ChunkStore(index_dir)
+        self.bm25 = BM25Index(index_dir) if BM25Index.exists(index_dir) else None
+        self.embedder = embedder
+        self.facets = {
+            field: {value: np.asarray(rows, dtype=np.int64) for value, rows in values.items()}
+            for field, values in self.chunks.facets(FILTER_FIELDS).items()
+        }
+
+        if self.index.ntotal != len(self.chunks):
+            raise ValueError(
+                f"{index_dir}: index has {self.index.ntotal} vectors but chunk store has {len(self.chunks)} chunks; re-run ingestion"
+            )
+        if self.bm25 is not None and self.bm25.n_docs != len(self.chunks):
+            raise ValueError(
+                f"{index_dir}: BM25 index has {self.bm25.n_docs} chunks but chunk store has {len(self.chunks)}; re-run ingestion"
+            )
+        print(f"FAISS retriever ready: {self.index.ntotal} vectors, BM25 {'on' if self.bm25 else 'off'}, from {index_dir}")
+
+    def known_values(self):
+        return {field: sorted(values) for field, values in self.facets.items()}
+
+    def fetch(self, chunk_ids):
+        """Documents for chunk IDs (result-cache hits); ids no longer in the store are skipped."""
+        rows = (self.chunks.row_of(cid) for cid in chunk_ids)
+        return [self.chunks.get(row) for row in rows if row is not None]
+
+    async def afetch(self, chunk_ids):
+        # a few mmap reads, no I/O worth awaiting
+        return self.fetch(chunk_ids)
+
+    def filter_rows(self, filters):
+        """Sorted rows matching every filtered field (any of its values); None = no filter."""
+        import numpy as np
+
+        rows = None
+        for field, values in (filters or {}).items():
+            field_rows = [self.facets.get(field, {}).get(v) for v in values]
+            field_rows = np.unique(np.concatenate([r for r in field_rows if r is not None] or [np.empty(0, dtype=np.int64)]))
+            rows = field_rows if rows is None else np.intersect1d(rows, field_rows)
+        return rows
+
+    def knn(self, query_vector, k=10, rows=None):
+        import faiss
+        import numpy as np
+
+        vector = np.asarray([query_vector], dtype=np.float32)
+        if rows is None:
+            distances, ids = self.index.search(vector, k)
+        elif len(rows) == 0:
+            return []
+        else:
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(rows))
+            distances, ids = self.index.search(vector, k, params=params)
+        return [self.chunks.get(int(row), score=float(dist)) for row, dist in zip(ids[0], distances[0]) if row != -1]
+
+    def bm25_search(self, query, k=10, rows=None):
+        if self.bm25 is None or (rows is not None and len(rows) == 0):
+            return []
+        from src.bm25_index import bm25_retrieve_local
+        return bm25_retrieve_local(query, self.bm25, self.chunks, k=k, rows=rows)
+
+    def _bm25_leg(self, query, k_bm25, rows, timings):
+        t0 = time.perf_counter()
+        docs = self.bm25_search(query, k=k_bm25, rows=rows)
+        timings["bm25_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+        return docs
+
+    def _finish(self, bm25_docs, query_vector, k_sem, top_n, rows, timings, start):
+        t0 = time.perf_counter()
+        semantic_docs = self.knn(query_vector, k=k_sem, rows=rows)
+        timings["knn_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+
+        combined = fuse_rrf([bm25_docs, semantic_docs], top_n=top_n)
+        timings["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return len(bm25_docs), len(semantic_docs), len(combined), combined, timings
+
+    def retrieve(self, query, k_bm25=10, k_sem=10, top_n=None, filters=None):
+        timings = {}
+        start = time.perf_counter()
+        rows = self.filter_rows(filters)
+        # BM25 is scored while the embedding request is in flight
+        bm25_future = _retrieval_executor.submit(self._bm25_leg, query, k_bm25, rows, timings)
+        query_vector = self.embedder.embed_query(query)
+        timings["embed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return self._finish(bm25_future.result(), query_vector, k_sem, top_n, rows, timings, start)
+
+    async def aretrieve(self, query, k_bm25=10, k_sem=10, top_n=None, filters=None):
+        # both searches take about a millisecond, so they run inline on the event loop
+        # while the embedding request is in flight
+        timings = {}
+        start = time.perf_counter()
+        rows = self.filter_rows(filters)
+        embed_task = asyncio.ensure_future(self.embedder.aembed_query(query))
+        bm25_docs = self._bm25_leg(query, k_bm25, rows, timings)
+        query_vector = await embed_task
+        timings["embed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return self._finish(bm25_docs, query_vector, k_sem, top_n, rows, timings, start)
+
+
+def load_retriever(backend, embedder, opensearch_client=None, async_opensearch_client=None, index_name="rag-docs", index_dir="faiss_index", parallel=True):
+    if backend == "faiss":
+        return FaissRetriever(index_dir, embedder)
+    if backend == "opensearch":
+        return OpenSearchRetriever(opensearch_client, async_opensearch_client, embedder, index_name, parallel=parallel)
+    raise ValueError(f"Unknown RETRIEVER_BACKEND: {backend!r} (expected 'opensearch' or 'faiss')")
+
+
 def show(results, preview_chars=300):
     for i, doc in enumerate(results):
         print(f"\n----- Chunk {i + 1} -----")
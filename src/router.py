@@ -1,6 +1,7 @@
 import os
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
+from src.local_router import load_local_router
 
 load_dotenv()
 
@@ -20,4 +21,25 @@ def route_query(query, router_llm, router_prompt):
         return "rag"
     else:
         return "direct"
-    
\ No newline at end of file
+
+
+async def aroute_query(query, router_llm, router_prompt):
+    response = await router_llm.ainvoke(router_prompt.format(query=query))
+    decision = response.content.strip().lower()
+
+    if "rag" in decision:
+        return "rag"
+    else:
+        return "direct"
+
+
+def local_route(query, local_router, threshold=None):
+    """
+    Route on-box. Returns (decision, confidence); decision is None when the
+    local model is below its calibrated threshold and the LLM should decide.
+    """
+    decision, confidence = local_router.predict(query)
+    threshold = local_router.threshold if threshold is None else threshold
+    if confidence < threshold:
+        return None, confidence
+    return decision, confidence
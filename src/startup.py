@@ -0,0 +1,133 @@
+"""
+Parallel, dependency-aware service startup.
+
+Components are registered with the names they are published under and the
+components they need. start() returns immediately; every component is built on
+its own thread as soon as its dependencies are ready, so independent ones
+(Redis, LLM clients, OpenSearch, the reranker weights) initialise side by side
+instead of one after the other at import time.
+
+Critical components gate readiness: request handlers wait for them and /ready
+reports 503 until they are up. Non-critical ones (e.g. the cross-encoder in
+background mode) keep loading while traffic is already being served; callers
+check is_ready() and degrade until then.
+"""
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+
+class ComponentUnavailable(RuntimeError):
+    """A critical component failed to initialise (or one of its dependencies did)."""
+
+
+class StartupManager:
+    def __init__(self, namespace=None, retries=0, backoff_s=1.0):
+        # ready components are published here under their names (main.py passes globals())
+        self.namespace = namespace if namespace is not None else {}
+        # a failing fn() is retried `retries` times, waiting backoff_s, 2 x backoff_s, ... in between
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self._components = {}
+        self._futures = {}
+        self._status = {}
+        self._lock = threading.Lock()
+        self._started_at = None
+
+    def register(self, name, fn, deps=(), critical=True):
+        """fn() builds the component; it runs only after every name in `deps` is ready."""
+        self._components[name] = {"fn": fn, "deps": tuple(deps), "critical": critical}
+        self._futures[name] = Future()
+        self._status[name] = {"status": "pending", "critical": critical}
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        # one thread per component: a component blocked on its dependencies never starves another
+        executor = ThreadPoolExecutor(max_workers=max(len(self._components), 1), thread_name_prefix="startup")
+        for name in self._components:
+            executor.submit(self._run, name)
+        executor.shutdown(wait=False)
+        return self
+
+    def _set(self, name, **fields):
+        with self._lock:
+            self._status[name].update(fields)
+
+    def _run(self, name):
+        component = self._components[name]
+        future = self._futures[name]
+
+        for dep in component["deps"]:
+            try:
+                self._futures[dep].result()
+            except Exception as e:
+                self._set(name, status="failed", error=f"dependency '{dep}' failed")
+                future.set_exception(ComponentUnavailable(f"{name}: dependency '{dep}' failed: {e}"))
+                return
+
+        self._set(name, status="loading")
+        t0 = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                value = component["fn"]()
+                break
+            except Exception as e:
+                elapsed_ms = round((time.perf_counter() - t0) * 1000, 1)
+                if attempt < self.retries:
+                    delay = self.backoff_s * 2 ** attempt
+                    self._set(name, status="retrying", failures=attempt + 1, error=repr(e))
+                    print(f"⚠️ {name} failed to initialise ({e!r}), retry {attempt + 1}/{self.retries} in {delay:.1f} s")
+                    time.sleep(delay)
+                    continue
+                self._set(name, status="failed", init_ms=elapsed_ms, failures=attempt + 1, error=repr(e))
+                print(f"❌ {name} failed to initialise after {elapsed_ms} ms ({attempt + 1} attempts): {e!r}")
+                future.set_exception(ComponentUnavailable(f"{name}: {e!r}"))
+                return
+
+        elapsed_ms = round((time.perf_counter() - t0) * 1000, 1)
+        self.namespace[name] = value
+        self._set(name, status="ready", error=None, init_ms=elapsed_ms, ready_at_s=round(time.perf_counter() - self._started_at, 2))
+        print(f"✅ {name} ready in {elapsed_ms} ms")
+        future.set_result(value)
+
+    def _names(self, names):
+        if names is None:
+            return [n for n, c in self._components.items() if c["critical"]]
+        return list(names)
+
+    def status(self, name):
+        return self._status[name]["status"]
+
+    def is_ready(self, name):
+        future = self._futures[name]
+        return future.done() and future.exception() is None
+
+    def wait(self, names=None, timeout=None):
+        """Block until the given (default: all critical) components are ready; raises ComponentUnavailable."""
+        for name in self._names(names):
+            self._futures[name].result(timeout=timeout)
+
+    async def await_ready(self, names=None):
+        """asyncio counterpart of wait(); does not block the event loop."""
+        pending = [self._futures[n] for n in self._names(names) if not self._futures[n].done()]
+        if pending:
+            await asyncio.gather(*(asyncio.wrap_future(f) for f in pending))
+        self.wait(names)  # re-raise failures of components that were already done
+
+    def ready(self):
+        return all(self.is_ready(n) for n in self._names(None))
+
+    def failed(self):
+        """Critical components that gave up (retries exhausted, or a dependency failed); the process cannot serve."""
+        return [n for n in self._names(None) if self._futures[n].done() and self._futures[n].exception() is not None]
+
+    def report(self):
+        with self._lock:
+            components = {name: dict(status) for name, status in self._status.items()}
+        return {
+            "ready": self.ready(),
+            "failed": self.failed(),
+            "uptime_s": round(time.perf_counter() - self._started_at, 2) if self._started_at else 0.0,
+            "components": components,
+        }